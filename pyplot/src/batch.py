@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import sys
+import argparse
+import json
+from npac import args
+import lib_pipeline
+
+
+def get_batch_args():
+    """
+    Analyse the command line arguments of the batch driver.
+    """
+    parser = argparse.ArgumentParser(
+        description='Run the background, peaks, clusters and RA/Dec pipeline on many FITS frames')
+    parser.add_argument('patterns', nargs='+', type=str,
+                        help='directories, glob patterns or file names (default data path if no path)')
+    parser.add_argument('-j', dest='processes', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('-o', dest='output', type=str, default=None,
+                        help='output file, one JSON record per frame (default: standard output)')
+    parser.add_argument('-t', dest='tile', type=int, default=None,
+                        help='tile size of the background map (default: global threshold)')
+    return(parser.parse_args())
+
+def main():
+    """ Batch: process every frame of directories or glob patterns """
+
+    options = get_batch_args()
+
+    file_names = []
+    for pattern in options.patterns:
+        file_names += args.get_data_files(pattern)
+
+    if not file_names:
+        sys.stderr.write('No FITS file found for {}\n'.format(options.patterns))
+        return 1
+
+    if options.output is None:
+        output = sys.stdout
+    else:
+        output = open(options.output, 'w')
+
+    errors = 0
+    for record in lib_pipeline.process_files(file_names, options.tile, options.processes):
+        if 'error' in record:
+            errors += 1
+            sys.stderr.write('{}: {}\n'.format(record['file'], record['error']))
+        output.write(json.dumps(record) + '\n')
+
+    if output is not sys.stdout:
+        output.close()
+
+    sys.stderr.write('{:d} files processed, {:d} errors\n'.format(len(file_names), errors))
+    return 0 if errors == 0 else 2
+
+
+if __name__ == '__main__':
+    """ Execute the batch driver """
+    sys.exit(main())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import sys
+import time
+import tracemalloc
+import numpy as np
+import lib_conv
+
+
+def timing(function, *args):
+    """
+    Best wall time (seconds) out of 3 calls of function(*args).
+    """
+    best = None
+    for i in range(3):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return(best)
+
+def memory_peak(function, *args):
+    """
+    Peak memory (bytes) allocated while calling function(*args).
+    """
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return(peak)
+
+def main():
+    """ Benchmark: separable versus 2D convolution of the Gaussian pattern,
+    memory used to extend large frames """
+
+    size = 1024
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1])
+
+    pixels = np.random.RandomState(0).normal(1000.0, 50.0, (size, size))
+    print('image {:d}x{:d}'.format(size, size))
+    print('{:>6s} {:>14s} {:>14s} {:>14s} {:>10s}'.format('kernel', 'direct (s)', 'fft (s)', 'separable (s)', 'max diff'))
+
+    for k in range(5, 32, 2):
+        pat = lib_conv.pattern(k)
+        pat = pat / np.sum(pat)
+
+        column, row = lib_conv.separate(pat)
+
+        t_direct = timing(lib_conv.convolve_direct, pixels, pat)
+        t_fft = timing(lib_conv.convolve, pixels, pat, 'fft')
+        t_sep = timing(lib_conv.convolve_separable, pixels, column, row)
+
+        diff = np.max(np.abs(lib_conv.convolve_separable(pixels, column, row) - lib_conv.convolve_direct(pixels, pat)))
+
+        print('{:>6d} {:>14.4f} {:>14.4f} {:>14.4f} {:>10.2e}'.format(k, t_direct, t_fft, t_sep, diff))
+
+    print('{:>10s} {:>8s} {:>8s} {:>14s} {:>14s}'.format('frame', 'dtype', 'mode', 'extended (MB)', 'peak (MB)'))
+    for frame in (1024, 4096):
+        for dtype in (np.int16, np.float32):
+            image = np.zeros((frame, frame), dtype)
+            for mode in ('zero', 'edge', 'reflect'):
+                extended = lib_conv.extend(image, 4, mode)
+                peak = memory_peak(lib_conv.extend, image, 4, mode)
+                print('{:>10s} {:>8s} {:>8s} {:>14.1f} {:>14.1f}'.format(
+                    '{:d}x{:d}'.format(frame, frame), np.dtype(dtype).name, mode, extended.nbytes / 1e6, peak / 1e6))
+
+    return 0
+
+
+if __name__ == '__main__':
+    """ Execute the benchmark """
+    sys.exit(main())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import sys
+import argparse
+import json
+import subprocess
+
+# Entry points and pipeline modules whose import time is tracked.
+ENTRY_POINTS = ['ex1_read_image', 'ex2_background', 'ex3_peaks', 'ex4_clusters',
+                'ex5_stars', 'ex6_show_stars', 'batch',
+                'lib_fits', 'lib_background', 'lib_conv', 'lib_cluster',
+                'lib_frame', 'lib_stars', 'lib_pipeline',
+                'npac.coordinates', 'npac.stars']
+
+# Heavy dependencies reported when they are imported by an entry point.
+HEAVY = ['numpy', 'scipy', 'scipy.optimize', 'matplotlib', 'matplotlib.pyplot',
+         'astropy', 'astropy.io.fits', 'astropy.wcs', 'urllib.request']
+
+
+def import_times(module):
+    """
+    Import module in a fresh interpreter with python -X importtime.
+    Returns a dictionary {imported module: cumulative time (us)}.
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        times[fields[2].strip()] = int(fields[1])
+    return(times)
+
+def measure(module, repeat):
+    """
+    Median cumulative import time (ms) of module over repeat runs,
+    and the heavy dependencies it imports.
+    """
+    totals = []
+    for i in range(repeat):
+        times = import_times(module)
+        totals.append(times.get(module, 0) / 1000.0)
+    totals.sort()
+    heavy = [name for name in HEAVY if name in times]
+    return(totals[len(totals) // 2], heavy)
+
+def get_bench_args():
+    """
+    Analyse the command line arguments of the benchmark.
+    """
+    parser = argparse.ArgumentParser(description='Import time of the pipeline entry points')
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINTS, help='modules to import')
+    parser.add_argument('-n', dest='repeat', type=int, default=5, help='runs per module (median)')
+    parser.add_argument('-o', dest='output', type=str, default=None, help='save the results (JSON)')
+    parser.add_argument('-c', dest='compare', type=str, default=None, help='compare with saved results (JSON)')
+    return(parser.parse_args())
+
+def main():
+    """ Benchmark: import time of each entry point """
+
+    options = get_bench_args()
+
+    reference = {}
+    if options.compare is not None:
+        with open(options.compare) as saved:
+            reference = json.load(saved)
+
+    results = {}
+    print('{:>18s} {:>10s} {:>10s}  {}'.format('module', 'time (ms)', 'change', 'heavy imports'))
+    for module in options.modules:
+        elapsed, heavy = measure(module, options.repeat)
+        results[module] = elapsed
+        if module in reference:
+            change = '{:>+10.0f}'.format(elapsed - reference[module])
+        else:
+            change = '{:>10s}'.format('-')
+        print('{:>18s} {:>10.0f} {}  {}'.format(module, elapsed, change, ' '.join(heavy)))
+
+    if options.output is not None:
+        with open(options.output, 'w') as saved:
+            json.dump(results, saved, indent=1, sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    """ Execute the benchmark """
+    sys.exit(main())
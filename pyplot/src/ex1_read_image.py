@@ -1,11 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import sys
-from npac import args
-from astropy.io import fits
-import numpy as np
-import matplotlib.pyplot as plt
 import lib_fits
+import lib_plot
 
 def main():
     """ Exercise 1: Read Image """
@@ -18,9 +15,7 @@ def main():
 
     # show figure
     if lib_fits.interactive:
-        fig, main_axes = plt.subplots()
-        main_axes.imshow(pixels)
-        plt.show()
+        lib_plot.show_image(pixels)
 
     #signature
 
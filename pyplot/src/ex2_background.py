@@ -1,12 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import sys
-from npac import args
 import numpy as np
-import matplotlib.pyplot as plt
 import lib_fits
 import lib_background
-import scipy
 
 def main():
     """ Exercise 2: Background """
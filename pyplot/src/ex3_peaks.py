@@ -2,9 +2,9 @@
 # -*- coding: utf-8 -*-
 import sys
 import lib_fits
-import lib_background
+import lib_plot
+import lib_frame
 import numpy as np
-import matplotlib.pyplot as plt
 import lib_conv
 
 
@@ -18,8 +18,6 @@ def main():
 
     # Build Gaussian pattern
     pattern = lib_conv.pattern(9)
-    plt.imshow(pattern)
-    #plt.show()
 
     sum_pat = np.sum(pattern)
     pattern = pattern/sum_pat
@@ -34,8 +32,8 @@ def main():
 
     # Extend the image
     extended = lib_conv.extend(pixels, 4)
-    plt.imshow(extended)
-    plt.show()
+    if lib_fits.interactive:
+        lib_plot.show_image(extended)
 
     height = len(extended)
     width = len(extended[0])
@@ -54,8 +52,8 @@ def main():
 
     conv = lib_conv.scan(extended, 4, pattern)
 
-    plt.imshow(conv)
-    plt.show()
+    if lib_fits.interactive:
+        lib_plot.show_image(conv)
 
     conv_height = len(conv)
     conv_width = len(conv[0])
@@ -88,7 +86,7 @@ def main():
     # Identify the Peaks
 
 
-    threshold = lib_background.threshold(pixels)
+    threshold = lib_frame.analysis(pixels).threshold()
     print(threshold)
     peaks = lib_conv.peaks(conv_ext, 1, threshold)
 
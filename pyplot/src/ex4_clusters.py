@@ -1,9 +1,9 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import sys
-import matplotlib.pyplot as plt
 import lib_fits
-import lib_background
+import lib_plot
+import lib_frame
 import lib_conv
 import lib_cluster
 
@@ -14,14 +14,16 @@ def main():
     print(lib_fits.file_name)
     header, pixels = lib_fits.read_first_image(lib_fits.file_name)
 
-    thres = lib_background.threshold(pixels)
+    frame = lib_frame.analysis(pixels)
+    thres = frame.threshold()
 
     peaks = lib_conv.complete_peaks_search(pixels)
     lums = lib_cluster.peak_lum(pixels, peaks)
+    integral = frame.integral()
 
     clusters = []
     for i in range(len(peaks)):
-        clust = lib_cluster.build_cluster(pixels, peaks[i], thres)
+        clust = lib_cluster.build_cluster(pixels, peaks[i], thres, integral)
         if clust == None :
             continue
         else :
@@ -36,22 +38,8 @@ def main():
     sort_clus = lib_cluster.sort_clusters(clusters)
     bcfe = sort_clus[0]
 
-    fig, main_axes = plt.subplots()
-    main_axes.imshow(pixels)
-
-    # Draws clusters arround peaks.
-    for i in range(len(clusters)):
-        xleft = clusters[i].coord[0]-clusters[i].ext
-        xright =  clusters[i].coord[0] + clusters[i].ext
-        ybottom = clusters[i].coord[1]-clusters[i].ext
-        ytop = clusters[i].coord[1] + clusters[i].ext
-        squarex = [xleft, xright, xright, xleft, xleft]
-        squarey = [ybottom, ybottom, ytop, ytop, ybottom]
-        plt.plot(squarey, squarex, 'r--')
-
-    plt.show()
-
-
+    if lib_fits.interactive:
+        lib_plot.show_clusters(pixels, clusters)
 
     signature_fmt_3 = 'RESULT: cluster_max_integral={:d}'.format(bcfe.lum)
     signature_fmt_4 = 'RESULT: cluster_max_column={:d}'.format(bcfe.coord[1])
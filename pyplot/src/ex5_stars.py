@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 import sys
 from npac import stars
+from npac import coordinates
 import lib_fits
 import lib_cluster
 import lib_stars
@@ -18,10 +19,8 @@ def main():
 
     clusters = lib_cluster.find_clusters(pixels)
 
-    clusters_radec = []
-    for i in range(len(clusters)):
-        clusters_radec.append(lib_stars.get_radec(clusters[i].coord[0], clusters[i].coord[1], header, pixels))
-
+    lib_stars.fill_radec(clusters, header)
+    clusters_radec = [coordinates.RaDec(cluster.ra, cluster.dec) for cluster in clusters]
 
     signature_fmt_1 = 'RESULT: right_ascension = {:.3f}'.format(clusters_radec[0][0])
     signature_fmt_2 = 'RESULT: declination = {:.3f}'.format(clusters_radec[0][1])
@@ -14,11 +14,9 @@ def main():
     global header
     header, pixels = lib_fits.read_first_image(lib_fits.file_name)
 
-    clusters = lib_cluster.find_clusters(pixels)
+    clusters = lib_cluster.find_clusters(pixels, 6)
 
-    for i in range(6):
-        rad = lib_stars.cluster_radec(clusters, i, header, pixels)
-        lib_stars.celestial_objects(rad, i)
+    lib_stars.clusters_celestial_objects(clusters, 6, header)
     return 0
 
 if __name__ == '__main__':
@@ -1,11 +1,163 @@
 # -*- coding: utf-8 -*-
+import collections
+import concurrent.futures
 import numpy as np
-import matplotlib.pyplot as plt
-import scipy.optimize as scp
+import lib_plot
+
+# Result of a background estimation :
+# - histogram (bin_values, bin_boundaries),
+# - un-normalized fit parameters (maxvalue, background, dispersion) and their covariance,
+# - threshold for the peaks.
+BackgroundResult = collections.namedtuple('BackgroundResult', [
+    'bin_values', 'bin_boundaries',
+    'maxvalue', 'background', 'dispersion', 'covariance',
+    'threshold'])
+
+# Background and noise maps of a frame, with the per-pixel threshold for the peaks.
+BackgroundMap = collections.namedtuple('BackgroundMap', ['background', 'rms', 'threshold'])
+
+# Integer pixels are counted value by value (see integer_histogram) when
+# the span of their values is below this number of levels.
+INTEGER_MAX_SPAN = 1 << 24
+
+# Number of pixels counted at once by integer_histogram.
+INTEGER_CHUNK = 1 << 16
+
+def is_integer_span(pixels, low, high):
+    """
+    True if pixels are integers whose values between low and high
+    can be counted value by value.
+    """
+    return(np.asarray(pixels).dtype.kind in 'iu' and int(high) - int(low) < INTEGER_MAX_SPAN)
+
+def integer_histogram(pixels, nbins, value_range=None):
+    """
+    Histogram of integer pixels, identical to np.histogram(pixels, nbins, value_range) :
+    each integer value is counted once with bincount, then the distinct
+    values (weighted by their counts) are distributed in the nbins bins.
+    """
+    values = np.ravel(pixels)
+    if value_range is None:
+        low, high = values.min(), values.max()
+    else:
+        low, high = value_range
+
+    # Integer levels covered by the range
+    first = int(np.ceil(low))
+    last = int(np.floor(high))
+
+    # Count by chunks, so the index copies stay in cache,
+    # but much larger than the number of levels, each chunk allocating its counts
+    counts = np.zeros(last - first + 1, np.intp)
+    chunk = max(INTEGER_CHUNK, 4 * len(counts))
+    for start in range(0, len(values), chunk):
+        index = values[start:start + chunk].astype(np.intp)
+        index -= first
+        # Values outside of the range are dropped, as np.histogram does
+        if value_range is not None:
+            index = index[(index >= 0) & (index <= last - first)]
+        counts += np.bincount(index, minlength=last - first + 1)
+
+    levels = np.arange(first, last + 1)
+    if value_range is None:
+        weighted, bin_boundaries = np.histogram(levels, nbins, (values.min(), values.max()), weights=counts)
+    else:
+        weighted, bin_boundaries = np.histogram(levels, nbins, value_range, weights=counts)
+
+    return(weighted.astype(np.intp), bin_boundaries)
+
+class HistogramAccumulator(object):
+    """ Histogram with nbins fixed bins over value_range,
+        filled block by block (see add).
+    """
+
+    def __init__(self, nbins, value_range):
+        """
+        Define empty bins, as np.histogram does for this range.
+        """
+        low, high = value_range
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+        self.nbins = nbins
+        self.value_range = (low, high)
+        self.bin_values = np.zeros(nbins, np.intp)
+        self.bin_boundaries = None
+
+    def add(self, block):
+        """
+        Count the values of block (any shape) in the bins.
+        """
+        if is_integer_span(block, *self.value_range):
+            values, self.bin_boundaries = integer_histogram(block, self.nbins, self.value_range)
+        else:
+            values, self.bin_boundaries = np.histogram(np.ravel(block), self.nbins, self.value_range)
+        self.bin_values += values
+        return 0
+
+def row_blocks(pixels, block_rows, step=1):
+    """
+    Yield the pixels 2D array (or memory-mapped HDU data/section) by blocks
+    of block_rows rows, keeping one row and one column out of step.
+    """
+    height = pixels.shape[0]
+    for start in range(0, height, block_rows):
+        # First row of the block which is a multiple of step
+        first = start + (-start) % step
+        stop = min(start + block_rows, height)
+        if first < stop:
+            yield np.asarray(pixels[first:stop:step, ::step])
+
+def streaming_histogram(pixels, nbins, block_rows=256, step=1):
+    """
+    Histogram with nbins bins of a pixels 2D array read by blocks of
+    block_rows rows, so memory-mapped frames are never loaded at once.
+    A first pass finds the value range, a second one fills the bins.
+    With step > 1, only one row and one column out of step are used.
+    With step = 1 the result is identical to histogram(pixels, nbins).
+    Subsampling is meant for large frames : with 4000x3000 pixels and step = 4
+    the fitted threshold moves by less than 0.1%, but below ~1e5 sampled
+    pixels the histogram gets too sparse for a reliable fit.
+    """
+    low = None
+    high = None
+    for block in row_blocks(pixels, block_rows, step):
+        if block.size == 0:
+            continue
+        if low is None:
+            low, high = block.min(), block.max()
+        else:
+            low, high = min(low, block.min()), max(high, block.max())
+
+    if low is None:
+        raise ValueError("No pixel to histogram")
+
+    accumulator = HistogramAccumulator(nbins, (low, high))
+    for block in row_blocks(pixels, block_rows, step):
+        accumulator.add(block)
+
+    return(accumulator.bin_values, accumulator.bin_boundaries)
+
+def histogram(pixels, nbins, block_rows=None, step=1):
+    """
+    Histogram with nbins bins of pixels 2D array, as (bin_values, bin_boundaries).
+    Integer pixels are counted value by value (see integer_histogram).
+    If block_rows or step is given, pixels are read by blocks (see streaming_histogram).
+    """
+    if block_rows is None and step == 1:
+        pixels = np.asarray(pixels)
+        if pixels.dtype.kind in 'iu' and pixels.size > 0 and is_integer_span(pixels, pixels.min(), pixels.max()):
+            return(integer_histogram(pixels, nbins))
+        return(np.histogram(np.ravel(pixels), nbins))
+
+    if block_rows is None:
+        block_rows = 256
+    return(streaming_histogram(pixels, nbins, block_rows, step))
 
 def create_histo(pixels, nbins):
     """
     Create histogram with nbins bins out of pixels 2D array.
+    The histogram is stored in the module (bin_values, bin_boundaries),
+    use histogram or estimate_background to process several frames concurrently.
     """
     global histo
     global bin_values
@@ -14,7 +166,7 @@ def create_histo(pixels, nbins):
     histo = pixels.ravel()
     #print(histo)
 
-    bin_values, bin_boundaries = np.histogram(histo, nbins)
+    bin_values, bin_boundaries = histogram(histo, nbins)
     print("Histogram has been created !")
 
     return 0
@@ -34,17 +186,35 @@ def apply_model(input_array, p1, p2, p3):
     Compute expected value of modeling function on input_array.
     """
 
-    output_array = []
-    for i in range(len(input_array)):
-        output_array.append(modelling_function(input_array[i], p1, p2, p3))
-    return(np.array(output_array))
+    output_array = modelling_function(np.asarray(input_array, np.float64), p1, p2, p3)
+    return(output_array)
+
+def evaluate_model(input_arrays, parameters):
+    """
+    Compute the modeling function for a batch of parameter sets in one call.
+    parameters is a (P, 3) array of (p1, p2, p3),
+    input_arrays is a (N,) array shared by all the parameter sets or a (P, N) array.
+    Returns a (P, N) array.
+    """
+    parameters = np.atleast_2d(np.asarray(parameters, np.float64))
+    input_arrays = np.atleast_2d(np.asarray(input_arrays, np.float64))
+
+    if parameters.shape[-1] != 3:
+        raise ValueError("Parameters must be (p1, p2, p3) sets, got shape {}".format(parameters.shape))
+
+    # Columns of parameters broadcast along the x axis
+    p1 = parameters[:, 0:1]
+    p2 = parameters[:, 1:2]
+    p3 = parameters[:, 2:3]
+
+    return(modelling_function(input_arrays, p1, p2, p3))
 
 def normalize(bin_values, bin_boundaries):
     """
     Normalize the histogram.
     """
-    mval = np.float(np.max(bin_values))
-    mbound = np.float(np.max(bin_boundaries))
+    mval = float(np.max(bin_values))
+    mbound = float(np.max(bin_boundaries))
     normal_val = bin_values/mval
     normal_bound = bin_boundaries[:-1]/mbound
     return(normal_val, normal_bound)
@@ -53,61 +223,276 @@ def max_array(input):
     """
     Extract max value of input_array.
     """
-    return(np.float(np.max(input)))
+    return(float(np.max(input)))
 
-def fit_and_return(normal_bound, normal_val):
+def fit_histogram(bin_values, bin_boundaries):
+    """
+    Fit the normalized histogram.
+    Return the un-normalized fit parameters (maxvalue, background, dispersion)
+    and their covariance matrix.
+    """
+    # scipy is slow to import, only the fitting stages need it
+    import scipy.optimize as scp
+
+    norm_val, norm_bound = normalize(bin_values, bin_boundaries)
+    fit, covariant = scp.curve_fit(modelling_function, norm_bound, norm_val)
+
+    scale = np.array([max_array(bin_values), max_array(bin_boundaries), max_array(bin_boundaries)])
+    # the model only depends on the square of the dispersion, so curve_fit
+    # may give a negative one: keep its absolute value
+    if fit[2] < 0:
+        scale[2] = -scale[2]
+    parameters = fit * scale
+    covariance = covariant * np.outer(scale, scale)
+
+    return(parameters, covariance)
+
+def fit_and_return(normal_bound, normal_val, bin_values=None, bin_boundaries=None):
     """
     Fit the histogram and return the un-normalized fit parameters.
+    By default the histogram is the one stored by create_histo.
+    The normalized histogram (normal_bound, normal_val) is computed again
+    by fit_histogram.
     """
-    fit, covariant = scp.curve_fit(modelling_function, normal_bound, normal_val)
+    if bin_values is None:
+        bin_values = globals()['bin_values']
+    if bin_boundaries is None:
+        bin_boundaries = globals()['bin_boundaries']
 
-    maxvalue = fit[0] * max_array(bin_values)
-    background = fit[1] * max_array(bin_boundaries)
-    dispersion = fit[2] * max_array(bin_boundaries)
+    parameters, covariance = fit_histogram(bin_values, bin_boundaries)
 
-    return(maxvalue, background, dispersion)
+    return(tuple(parameters))
 
 def plotting(x1, y1, y2):
     """
-    Plot the original histogram and its fit.
+    Plot the original histogram and its fit (see lib_plot.show_histogram).
     """
-    fig, main_axes = plt.subplots()
-    plt.plot(x1, y1, 'b+:', label='data')
-    plt.plot(x1, y2, 'r.:', label='fit')
+    return(lib_plot.show_histogram(x1, y1, y2))
 
-    plt.xlabel("Amplitude", fontsize=16)
-    plt.ylabel("Frequency", fontsize=16)
-    plt.title("Flux distribution", fontsize=20)
+# Integer histograms whose bins hold less levels than this are corrected by fit_peak_bins :
+# above it, one level more or less changes the count of a bin by less than 10%.
+INTEGER_PEAK_LEVELS = 10
 
-    plt.legend()
+def integer_levels(bin_boundaries):
+    """
+    Number of integer levels in each bin (the last bin includes its upper boundary).
+    """
+    bounds = np.asarray(bin_boundaries, np.float64)
+    first = np.ceil(bounds[:-1])
+    stop = np.ceil(bounds[1:])
+    stop[-1] = np.floor(bounds[-1]) + 1
+    return(np.maximum(stop - first, 0))
 
+def fit_peak_bins(bin_values, bin_boundaries, integer=False):
+    """
+    Closed form Gaussian fit of the histogram : a parabola is fitted (linear
+    least squares) on the logarithm of the bins above half of the maximum
+    around the highest bin. Bins are located at their lower boundary, as in fit_histogram.
+    With less than 3 non empty peak bins, or no peak, the moments of the peak bins are used.
+    For integer pixels, bins narrower than INTEGER_PEAK_LEVELS levels hold alternately
+    n and n+1 levels (or none) : the bins without level are dropped and the counts are
+    divided by the number of levels of each bin (and scaled back to the mean number of
+    levels of a bin) before searching the peak bins.
+    Return the parameters (maxvalue, background, dispersion).
+
+    >>> print([float(p) for p in fit_peak_bins(np.array([0, 0, 9, 0, 0]), np.arange(6.0))])
+    [9.0, 2.0, 0.0]
+    """
+    x = np.asarray(bin_boundaries[:-1], np.float64)
+    y = np.asarray(bin_values, np.float64)
+
+    if integer:
+        levels = integer_levels(bin_boundaries)
+        if np.mean(levels) < INTEGER_PEAK_LEVELS:
+            # Bins without any level are always empty : they are not bins of the histogram
+            full = levels > 0
+            x = x[full]
+            y = y[full] / levels[full] * np.mean(levels[full])
+
+    top = int(np.argmax(y))
+    low = top
+    high = top
+    while low > 0 and y[low-1] > y[top] / 2:
+        low -= 1
+    while high < len(y) - 1 and y[high+1] > y[top] / 2:
+        high += 1
+    # A parabola needs at least 3 bins
+    low = max(0, min(low, top - 1))
+    high = min(len(y) - 1, max(high, top + 1))
+
+    xs = x[low:high+1] - x[top]
+    ys = y[low:high+1]
+    kept = ys > 0
+    xs = xs[kept]
+    ys = ys[kept]
+
+    # Poisson errors : log(y) has an error 1/sqrt(y)
+    c2 = 0.0
+    if len(xs) >= 3:
+        c2, c1, c0 = np.polyfit(xs, np.log(ys), 2, w=np.sqrt(ys))
+    if c2 >= 0:
+        # Too few bins or not peaked : fall back to the moments of the peak bins
+        mean = np.average(xs, weights=ys)
+        return(y[top], x[top] + mean, np.sqrt(np.average((xs - mean)**2, weights=ys)))
+
+    dispersion = np.sqrt(-1.0 / (2.0 * c2))
+    background = x[top] - c1 / (2.0 * c2)
+    maxvalue = np.exp(c0 - c1**2 / (4.0 * c2))
 
-    plt.show()
+    return(maxvalue, background, dispersion)
 
-    return 0
+# Background estimators :
+# - 'fit' : curve_fit of a Gaussian on the normalized histogram,
+# - 'peak' : closed form Gaussian fit on the peak bins of the histogram (fit_peak_bins),
+# - 'clip' : sigma-clipped median and standard deviation of the pixels,
+# - 'mad' : median and median absolute deviation (scaled to a Gaussian sigma) of the pixels.
+HISTOGRAM_METHODS = ('fit', 'peak')
+PIXELS_METHODS = ('clip', 'mad')
 
+# Ratio between the standard deviation and the MAD of a Gaussian
+MAD_TO_SIGMA = 1.4826
 
-def threshold(pixels):
+def background_from_histogram(bin_values, bin_boundaries, nsigma=6.0, method='fit', integer=False):
     """
-    From the pixels 2D array, fits the histogram.
-    From fit parameters, give the threshold.
+    Fit a histogram and build the BackgroundResult,
+    the threshold being background + nsigma * dispersion.
+    method is 'fit' (with covariance) or 'peak' (closed form, no covariance),
+    integer tells the histogram counts integer pixels (see fit_peak_bins).
     """
+    if method == 'fit':
+        parameters, covariance = fit_histogram(bin_values, bin_boundaries)
+    elif method == 'peak':
+        parameters, covariance = fit_peak_bins(bin_values, bin_boundaries, integer), None
+    else:
+        raise ValueError("Unknown histogram background method : {}".format(method))
 
-    create_histo(pixels, 200)
+    maxvalue, background, dispersion = parameters
 
-    norm_val, norm_bound = normalize(bin_values, bin_boundaries)
+    return(BackgroundResult(bin_values=bin_values, bin_boundaries=bin_boundaries,
+                            maxvalue=maxvalue, background=background, dispersion=dispersion,
+                            covariance=covariance,
+                            threshold=background + nsigma * dispersion))
 
-    results = fit_and_return(norm_bound, norm_val)
+def background_from_pixels(pixels, nsigma=6.0, method='clip'):
+    """
+    Estimate the background with robust statistics of the pixels, without histogram.
+    method is 'clip' or 'mad'. The histogram, maxvalue and covariance of the
+    BackgroundResult are None.
+    """
+    if method == 'clip':
+        background, dispersion = sigma_clip_stats(pixels)
+    elif method == 'mad':
+        values = np.ravel(pixels)
+        background = np.median(values)
+        dispersion = MAD_TO_SIGMA * np.median(np.abs(values - background))
+    else:
+        raise ValueError("Unknown pixels background method : {}".format(method))
+
+    return(BackgroundResult(bin_values=None, bin_boundaries=None,
+                            maxvalue=None, background=background, dispersion=dispersion,
+                            covariance=None,
+                            threshold=background + nsigma * dispersion))
+
+def estimate_background(pixels, nbins=200, nsigma=6.0, method='fit', block_rows=None, step=1):
+    """
+    From the pixels 2D array, estimates the background and returns a BackgroundResult.
+    method is one of HISTOGRAM_METHODS (on a nbins histogram) or PIXELS_METHODS.
+    For huge frames, the histogram can be built by blocks of block_rows rows and on
+    one row and one column out of step (see streaming_histogram).
+    Pixels methods only use step.
+    Nothing is stored in the module, so frames can be processed in parallel threads.
+
+    Integer frames whose bins are narrower than 2 levels :
+    >>> pixels = np.random.RandomState(0).normal(1000, 30, (300, 300)).astype(np.int16)
+    >>> result = estimate_background(pixels, method='peak')
+    >>> print(round(float(result.dispersion)))
+    30
+    """
+    if method in PIXELS_METHODS:
+        return(background_from_pixels(pixels[::step, ::step], nsigma, method))
 
-    background = results[1]
-    dispersion = results[2]
+    bin_values, bin_boundaries = histogram(pixels, nbins, block_rows, step)
+    integer = np.dtype(pixels.dtype).kind in 'iu'
+    return(background_from_histogram(bin_values, bin_boundaries, nsigma, method, integer))
 
-    threshold = background + 6.0 * dispersion
+def estimate_backgrounds(frames, nbins=200, nsigma=6.0, method='fit', workers=None):
+    """
+    Run estimate_background on a list of pixels 2D arrays in a pool of threads.
+    Returns the list of BackgroundResult, in the order of frames.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda pixels: estimate_background(pixels, nbins, nsigma, method), frames)
+        return(list(results))
 
-    return(threshold)
+def sigma_clip_stats(values, nsigma=3.0, iterations=5):
+    """
+    Median and standard deviation of values, after iteratively rejecting
+    the values further than nsigma standard deviations from the median.
+    """
+    values = np.ravel(values)
+    for i in range(iterations):
+        median = np.median(values)
+        std = np.std(values)
+        keep = np.abs(values - median) <= nsigma * std
+        if keep.all() or not keep.any():
+            break
+        values = values[keep]
+
+    return(np.median(values), np.std(values))
+
+def interpolate_tiles(values, centers, size):
+    """
+    Linear interpolation along the first axis of values, known at the
+    (increasing) positions centers, on all the positions 0..size-1.
+    Positions outside of the centers take the value of the closest one.
+    """
+    if len(centers) == 1:
+        return(np.repeat(values, size, axis=0))
+
+    # Fractional index of every position among the centers
+    position = np.interp(np.arange(size), centers, np.arange(len(centers)))
+    low = np.minimum(np.floor(position).astype(np.intp), len(centers) - 2)
+    weight = (position - low)[(slice(None),) + (np.newaxis,) * (np.ndim(values) - 1)]
+
+    return(values[low] * (1.0 - weight) + values[low + 1] * weight)
+
+def background_map(pixels, tile=64, nsigma=6.0, workers=None):
+    """
+    Background and rms maps of the pixels 2D array, estimated with
+    sigma-clipped statistics on tile x tile boxes (processed in a pool of
+    threads), then bilinearly interpolated between the tile centers.
+    Returns a BackgroundMap whose threshold map is background + nsigma * rms.
+    """
+    pixels = np.asarray(pixels)
+    height, width = np.shape(pixels)
 
+    row_starts = np.arange(0, height, tile)
+    column_starts = np.arange(0, width, tile)
 
+    def tile_row(i):
+        stats = [sigma_clip_stats(pixels[i:i + tile, j:j + tile]) for j in column_starts]
+        return(stats)
 
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        stats = np.array(list(executor.map(tile_row, row_starts)), np.float64)
 
+    # Tile centers, the last tiles may be smaller
+    row_centers = (row_starts + np.minimum(row_starts + tile, height) - 1) / 2.0
+    column_centers = (column_starts + np.minimum(column_starts + tile, width) - 1) / 2.0
 
+    maps = interpolate_tiles(stats, row_centers, height)
+    maps = interpolate_tiles(np.swapaxes(maps, 0, 1), column_centers, width)
+    maps = np.swapaxes(maps, 0, 1)
+
+    background = maps[:, :, 0]
+    rms = maps[:, :, 1]
+
+    return(BackgroundMap(background=background, rms=rms, threshold=background + nsigma * rms))
+
+def threshold(pixels):
+    """
+    From the pixels 2D array, fits the histogram.
+    From fit parameters, give the threshold.
+    """
 
+    return(estimate_background(pixels).threshold)
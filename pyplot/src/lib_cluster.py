@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
+import heapq
 import numpy as np
-import lib_background
-import lib_conv
+import lib_frame
 
 
 class Cluster(object):
@@ -13,7 +13,7 @@ class Cluster(object):
         - luminosity of the peak.
     """
 
-    def ___init___(self,coord, lum, ext, lumpeak):
+    def __init__(self, coord=None, lum=None, ext=None, lumpeak=None):
         """
         Define cluster's parameters.
         """
@@ -22,6 +22,147 @@ class Cluster(object):
         self.ext = ext
         self.lumpeak = lumpeak
 
+class ClusterView(object):
+    """ Read-only view on one row of a ClusterCatalog,
+        with the same attributes as a Cluster (plus ra and dec).
+        The columns are written through the catalog (e.g. catalog.data['ra']).
+    """
+
+    __slots__ = ('row',)
+
+    def __init__(self, row):
+        """
+        row is a record of the catalog structured array.
+        """
+        self.row = row
+
+    @property
+    def coord(self):
+        """ Pixel coordinates [row, column] of the peak. """
+        return([int(self.row['coord_row']), int(self.row['coord_col'])])
+
+    @property
+    def lum(self):
+        """ Integral of the cluster. """
+        return(self.row['lum'])
+
+    @property
+    def ext(self):
+        """ Extension of the cluster. """
+        return(self.row['ext'])
+
+    @property
+    def lumpeak(self):
+        """ Luminosity of the peak. """
+        return(self.row['lumpeak'])
+
+    @property
+    def ra(self):
+        """ Right ascension (NaN until computed). """
+        return(self.row['ra'])
+
+    @property
+    def dec(self):
+        """ Declination (NaN until computed). """
+        return(self.row['dec'])
+
+
+class ClusterCatalog(object):
+    """ Columnar catalog of clusters, stored in a NumPy structured array with fields :
+        - coord_row, coord_col : pixel coordinates of the peak,
+        - lum : integral,
+        - ext : extension,
+        - lumpeak : luminosity of the peak,
+        - ra, dec : sky coordinates (NaN until computed).
+        An integer index gives a ClusterView, a string gives a column,
+        anything else (slice, mask, indices) gives a sub-catalog.
+    """
+
+    def __init__(self, data):
+        """
+        Wrap a structured array of clusters.
+        """
+        self.data = data
+
+    def __len__(self):
+        return(len(self.data))
+
+    def __iter__(self):
+        for i in range(len(self.data)):
+            yield ClusterView(self.data[i])
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return(self.data[key])
+        if isinstance(key, (int, np.integer)):
+            return(ClusterView(self.data[key]))
+        return(ClusterCatalog(self.data[key]))
+
+    def filter(self, mask):
+        """
+        Sub-catalog of the clusters where mask is True.
+        """
+        return(ClusterCatalog(self.data[np.asarray(mask, bool)]))
+
+    def sort(self, keys, reverse=False, top=None):
+        """
+        Catalog stably sorted by the given columns, the first one being the primary key.
+        If top is given, only the first top clusters are kept, and only the
+        clusters that can reach them (partition on the primary key) are sorted.
+        """
+        if isinstance(keys, str):
+            keys = [keys]
+
+        data = self.data
+        if top is not None and top < len(data):
+            if top <= 0:
+                return(ClusterCatalog(data[:0]))
+            # Candidates : all clusters at least as good as the top-th primary key.
+            primary = data[keys[0]]
+            if reverse:
+                kth = np.partition(primary, len(primary) - top)[len(primary) - top]
+                data = data[primary >= kth]
+            else:
+                kth = np.partition(primary, top - 1)[top - 1]
+                data = data[primary <= kth]
+
+        columns = []
+        for k in reversed(keys):
+            column = data[k]
+            if reverse:
+                # negating unsigned integers would wrap around
+                if column.dtype.kind in 'bu':
+                    column = column.astype(np.int64)
+                column = -column
+            columns.append(column)
+        order = np.lexsort(columns)
+        if top is not None:
+            order = order[:top]
+        return(ClusterCatalog(data[order]))
+
+def make_catalog(rows, columns, lums, ext, lumpeak):
+    """
+    Build a ClusterCatalog from one array per characteristic.
+    Luminosities keep the type of the input arrays (integers for raw frames).
+    """
+    lums = np.asarray(lums)
+    lumpeak = np.asarray(lumpeak)
+    dtype = np.dtype([('coord_row', np.intp), ('coord_col', np.intp),
+                      ('lum', lums.dtype.newbyteorder('=')), ('ext', np.intp),
+                      ('lumpeak', lumpeak.dtype.newbyteorder('=')),
+                      ('ra', np.float64), ('dec', np.float64)])
+
+    data = np.empty(len(lums), dtype)
+    data['coord_row'] = rows
+    data['coord_col'] = columns
+    data['lum'] = lums
+    data['ext'] = ext
+    data['lumpeak'] = lumpeak
+    data['ra'] = np.nan
+    data['dec'] = np.nan
+
+    return(ClusterCatalog(data))
+
 def fmt(c):
     """
     Print cluster content of interest (without lumpeak).
@@ -35,17 +176,77 @@ def npix_r(r):
     """
     return((2*r+1)**2)
 
-def lum(pixels, r, i, j):
+def integral_image(pixels):
+    """
+    Summed-area table of the image : integral[p, q] is the sum of pixels[:p, :q].
+    Integer images are summed with 64 bits integers, other ones as floats.
+    """
+    pixels = np.asarray(pixels)
+    if pixels.dtype.kind in 'biu':
+        acc = np.int64
+    else:
+        acc = np.float64
+
+    integral = np.zeros((len(pixels) + 1, len(pixels[0]) + 1), acc)
+    np.cumsum(pixels, axis=0, dtype=acc, out=integral[1:, 1:])
+    np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+    return(integral)
+
+def box_sum(integral, top, bottom, left, right):
+    """
+    Sum of pixels[top:bottom, left:right] from the summed-area table.
+    """
+    return(integral[bottom, right] - integral[top, right] - integral[bottom, left] + integral[top, left])
+
+def square_sum(integral, i, j, r):
+    """
+    Sum of the square of radius r centred on (i,j), truncated to the image.
+    i, j and r may also be arrays, giving one sum per square.
+    """
+    height = len(integral) - 1
+    width = len(integral[0]) - 1
+    return(box_sum(integral, np.maximum(0, i-r), np.minimum(i+r+1, height), np.maximum(0, j-r), np.minimum(j+r+1, width)))
+
+def clamped_square_sum(integral, i, j, r):
+    """
+    Sum of the square of radius r centred on (i,j), where coordinates outside
+    of the image are clamped to its border : border rows and columns are
+    counted once for every outside row or column they replace.
+    i, j and r may also be arrays, giving one sum per square.
+    """
+    height = len(integral) - 1
+    width = len(integral[0]) - 1
+
+    top, bottom = np.maximum(0, i-r), np.minimum(i+r+1, height)
+    left, right = np.maximum(0, j-r), np.minimum(j+r+1, width)
+
+    # Number of rows (columns) outside of the image on each side
+    n_top, n_bottom = np.maximum(0, r-i), np.maximum(0, i+r+1-height)
+    n_left, n_right = np.maximum(0, r-j), np.maximum(0, j+r+1-width)
+
+    total = box_sum(integral, top, bottom, left, right)
+    total += n_top * box_sum(integral, 0, 1, left, right)
+    total += n_bottom * box_sum(integral, height-1, height, left, right)
+    total += n_left * box_sum(integral, top, bottom, 0, 1)
+    total += n_right * box_sum(integral, top, bottom, width-1, width)
+
+    # Corners are replicated in both directions
+    total += n_top * n_left * box_sum(integral, 0, 1, 0, 1)
+    total += n_top * n_right * box_sum(integral, 0, 1, width-1, width)
+    total += n_bottom * n_left * box_sum(integral, height-1, height, 0, 1)
+    total += n_bottom * n_right * box_sum(integral, height-1, height, width-1, width)
+
+    return(total)
+
+def lum(pixels, r, i, j, integral=None):
     """
     Compute the luminosity of a sub image, centre on a peak in (i,j) with a radius r.
+    Pixels outside of the image are replaced by the closest border pixel.
     """
-    lumi = 0
+    if integral is None:
+        integral = lib_frame.analysis(pixels).integral()
 
-    # Loop over all pixels in a sub image and add its luminosity.
-    for p in range(i-r,i+r+1):
-        for q in range(j-r, j+r+1):
-            lumi+=pixels[max(0, min(p, len(pixels)-1))][max(0, min(q, len(pixels[0])-1))]
-    return(lumi)
+    return(clamped_square_sum(integral, i, j, r))
 
 def peak_lum(pixels, peaks):
     """
@@ -56,29 +257,36 @@ def peak_lum(pixels, peaks):
         lums.append(pixels[peaks[i][0]][peaks[i][1]])
     return(lums)
 
-def build_cluster(pixels, peak, threshold):
+def build_cluster(pixels, peak, threshold, integral=None):
     """
     For a given peak, try to build a cluster,
     take the average luminosity of surounded pixels and compare it with the threshold.
     It returns a cluster or a None if it does not exist.
+    The threshold is a number or a per-pixel array (the value at the peak is used).
+    integral is the summed-area table of pixels (see integral_image),
+    by default the one shared by all the stages (see lib_frame).
     """
+    if integral is None:
+        integral = lib_frame.analysis(pixels).integral()
+
     # Extract sub image
     i = peak[0]
     j = peak[1]
 
+    if np.ndim(threshold) == 2:
+        threshold = threshold[i][j]
+
     r = 1
     avg = pixels[i][j]
-    integ0 = pixels[i][j]
+    integ0 = square_sum(integral, i, j, 0)
 
     # loop to have the max radius of the cluster.
     while avg > threshold :
-        subimage = pixels[max(0, i-r): min(i+r+1, len(pixels)), max(0, j-r):min(j+r+1, len(pixels[0]))]
-        # Compute the pixel sum
-        integ = np.sum(subimage) - integ0
+        # Compute the pixel sum of the ring at radius r
+        integ = square_sum(integral, i, j, r)
         # Average
-        avg = np.float(integ)/(npix_r(r)-npix_r(r-1))
-        #print(r, integ, integ0, avg - threshold, threshold, (npix_r(r)-npix_r(r-1)))
-        integ0 = np.sum(subimage)
+        avg = float(integ - integ0)/(npix_r(r)-npix_r(r-1))
+        integ0 = integ
         r+=1
     if r-2<1 :
         print("Cluster rejected")
@@ -86,55 +294,99 @@ def build_cluster(pixels, peak, threshold):
     else :
         C = Cluster()
         C.coord = [i, j]
-        C.lum = lum(pixels, r-2, i, j)
+        C.lum = lum(pixels, r-2, i, j, integral)
         C.ext = r-2
         C.lumpeak = pixels[i][j]
 
         return(C)
 
-def sort_clusters(clusters):
+def build_clusters(pixels, peaks, threshold, integral=None):
+    """
+    Batch version of build_cluster : grow the clusters of all the peaks
+    together, one ring per round, until their ring average falls below the threshold.
+    Returns the arrays (extension, luminosity, peak luminosity) with one
+    entry per peak, rejected peaks have an extension lower than 1 and a null luminosity.
+    The threshold is a number or a per-pixel array (the value at each peak is used).
+    """
+    if integral is None:
+        integral = lib_frame.analysis(pixels).integral()
+
+    peaks = np.reshape(np.asarray(peaks, np.intp), (-1, 2))
+    rows = peaks[:, 0]
+    columns = peaks[:, 1]
+
+    lumpeak = np.asarray(pixels)[rows, columns]
+
+    if np.ndim(threshold) == 2:
+        threshold = np.asarray(threshold)[rows, columns]
+    else:
+        threshold = np.full(len(peaks), threshold, np.float64)
+
+    r = np.ones(len(peaks), np.intp)
+    integ0 = square_sum(integral, rows, columns, 0)
+    active = lumpeak > threshold
+
+    # Each round adds one ring to all the clusters still above the threshold.
+    while np.any(active):
+        grow = np.nonzero(active)[0]
+        integ = square_sum(integral, rows[grow], columns[grow], r[grow])
+        avg = (integ - integ0[grow]).astype(np.float64) / (npix_r(r[grow]) - npix_r(r[grow]-1))
+        integ0[grow] = integ
+        r[grow] += 1
+        active[grow] = avg > threshold[grow]
+
+    ext = r - 2
+    accepted = ext >= 1
+    lums = clamped_square_sum(integral, rows, columns, np.where(accepted, ext, 0))
+    lums = np.where(accepted, lums, 0)
+
+    return(ext, lums, lumpeak)
+
+def sort_clusters(clusters, top=None):
     """
     Sort clusters by decreasing luminosity.
     If luminosity of two clusters are equal, we sort them with the peak luminosity.
+    Works on a ClusterCatalog or on a list of clusters.
+    If top is given, only the top brightest clusters are returned.
     """
+    if isinstance(clusters, ClusterCatalog):
+        return(clusters.sort(['lum', 'lumpeak'], reverse=True, top=top))
 
+    def key(cluster):
+        return((cluster.lum, cluster.lumpeak))
 
-    sorted_clusters = sorted(clusters, key=lambda cluster: cluster.lum, reverse=True)
-    # To print luminosities only to check the ordering process.
-    test = []
+    if top is not None:
+        return(heapq.nlargest(top, clusters, key=key))
+    return(sorted(clusters, key=key, reverse=True))
 
-    # loop over elements of sorted list.
-    for i in range(len(sorted_clusters)-2):
-        begin = i
-        end = i
-        while sorted_clusters[i].lum == sorted_clusters[end+1].lum:
-            end+=1
-        sorted(clusters[begin:end+1], key=lambda cluster: cluster.lumpeak, reverse=True)
-        test.append([sorted_clusters[i].lum, sorted_clusters[i].lumpeak])
-    return(sorted_clusters)
 
-
-def find_clusters(pixels):
+def find_clusters(pixels, top=None, tile=None):
     """
-    From the array of pixels, retunrs directly the sorted list of clusters.
+    From the array of pixels, retunrs directly the sorted catalog of clusters.
+    If top is given, only the top brightest clusters are kept.
+    If tile is given, the threshold is the tiled background map (see
+    lib_background.background_map) instead of the global one.
     Result of ex4.
     """
 
-    threshold = lib_background.threshold(pixels)
+    frame = lib_frame.analysis(pixels)
 
-    peaks = lib_conv.complete_peaks_search(pixels)
+    if tile is None:
+        threshold = frame.threshold()
+    else:
+        threshold = frame.background_map(tile).threshold
 
-    clusters = []
+    peaks = frame.peaks(tile)
 
-    # Loop over all the peaks.
-    for i in range(len(peaks)):
-        clust = build_cluster(pixels, peaks[i], threshold)
-        if clust == None :
-            continue
-        else :
-            clusters.append(clust)
+    ext, lums, lumpeak = build_clusters(pixels, peaks, threshold, frame.integral())
+
+    peaks = np.reshape(peaks, (-1, 2))
+    clusters = make_catalog(peaks[:, 0], peaks[:, 1], lums, ext, lumpeak)
+
+    # Keep the accepted peaks only.
+    clusters = clusters.filter(clusters['ext'] >= 1)
 
-    sort_clus = sort_clusters(clusters)
+    sort_clus = sort_clusters(clusters, top)
 
     return(sort_clus)
 
@@ -1,10 +1,10 @@
 # -*- coding: utf-8 -*-
 import numpy as np
-import lib_background
+import lib_frame
 
-def pattern(size):
+def gaussian(size):
     """
-    Give the 2D array convolution pattern for a given size.
+    Give the 2D Gaussian convolution pattern for a given size, silently.
     """
 
     x = np.arange(size)
@@ -14,41 +14,219 @@ def pattern(size):
     x0 = np.floor(len(x) / 2)
     y0 = np.floor(len(y) / 2)
 
-    print(x0, y0)
-
     pattern = np.exp(-1 * ((x - x0) ** 2 + (y - y0) ** 2) / 2.25 ** 2)  # c'est tout bon pour x0 et y0
 
     return(pattern)
 
-def extend(pixels,margin):
+def pattern(size):
+    """
+    Give the 2D array convolution pattern for a given size.
+    """
+
+    x0 = y0 = np.floor(size / 2)
+
+    print(x0, y0)
+
+    return(gaussian(size))
+
+def extend(pixels, margin, mode='zero'):
     """
     Extend image with margin lines and margin columns on each side.
+    The border is filled according to mode :
+    - 'zero' : with zeros,
+    - 'edge' : with the value of the closest pixel of the image,
+    - 'reflect' : with the mirror of the image (edge pixel not repeated).
+    The extended image is allocated once and keeps the type of pixels.
+    """
+    pixels = np.asarray(pixels)
+    height, width = np.shape(pixels)
+
+    extended = np.empty((height + 2*margin, width + 2*margin), pixels.dtype)
+    extended[margin:margin + height, margin:margin + width] = pixels
+
+    if margin == 0:
+        return(extended)
+
+    # Rows of the extended image covered by the original image
+    inner = extended[margin:margin + height]
+
+    if mode == 'zero':
+        extended[:margin] = 0
+        extended[margin + height:] = 0
+        inner[:, :margin] = 0
+        inner[:, margin + width:] = 0
+    elif mode == 'edge':
+        inner[:, :margin] = pixels[:, :1]
+        inner[:, margin + width:] = pixels[:, -1:]
+        extended[:margin] = inner[0]
+        extended[margin + height:] = inner[-1]
+    elif mode == 'reflect':
+        if margin >= height or margin >= width:
+            raise ValueError("Margin {} too large to reflect a {}x{} image".format(margin, height, width))
+        inner[:, :margin] = pixels[:, margin:0:-1]
+        inner[:, margin + width:] = pixels[:, ::-1][:, 1:margin + 1]
+        extended[:margin] = inner[margin:0:-1]
+        extended[margin + height:] = inner[::-1][1:margin + 1]
+    else:
+        raise ValueError("Unknown extension mode : {}".format(mode))
+
+    return(extended)
+
+def next_fast_len(n):
+    """
+    Smallest integer >= n whose only prime factors are 2, 3 and 5 (fast FFT sizes).
+    """
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return(n)
+        n += 1
+
+def convolve_direct(pixels, pattern):
+    """
+    Apply the pattern on every fully covered position of the image,
+    accumulating one shifted copy of the image per pattern coefficient.
+    """
+    kh, kw = np.shape(pattern)
+    height = np.shape(pixels)[0] - kh + 1
+    width = np.shape(pixels)[1] - kw + 1
+    output = np.zeros((height, width), np.float64)
+
+    # Looping over the pattern instead of the image
+    for p in range(kh):
+        for q in range(kw):
+            output += pattern[p, q] * pixels[p:p + height, q:q + width]
+
+    return(output)
+
+def convolve_fft(pixels, pattern, block=None):
+    """
+    Apply the pattern on every fully covered position of the image with FFTs.
+    If block is given, the image is cut in block x block tiles which are
+    transformed separately and summed back (overlap-add).
+    """
+    # scan correlates: convolving with the flipped pattern gives the same result
+    kernel = np.asarray(pattern, np.float64)[::-1, ::-1]
+    kh, kw = kernel.shape
+    height, width = np.shape(pixels)
+
+    if block is None:
+        bh, bw = height, width
+    else:
+        bh, bw = min(block, height), min(block, width)
+
+    fshape = (next_fast_len(bh + kh - 1), next_fast_len(bw + kw - 1))
+    kernel_fft = np.fft.rfft2(kernel, fshape)
+
+    full = np.zeros((height + kh - 1, width + kw - 1), np.float64)
+
+    # Looping over the tiles, each one contributes to its full convolution footprint
+    for i in range(0, height, bh):
+        for j in range(0, width, bw):
+            tile = np.asarray(pixels[i:i + bh, j:j + bw], np.float64)
+            th, tw = tile.shape
+            result = np.fft.irfft2(np.fft.rfft2(tile, fshape) * kernel_fft, fshape)
+            full[i:i + th + kh - 1, j:j + tw + kw - 1] += result[:th + kh - 1, :tw + kw - 1]
+
+    # Keep only the fully covered positions
+    return(full[kh - 1:height, kw - 1:width])
+
+def separate(pattern, tolerance=1e-10):
+    """
+    If the pattern is the outer product of two 1D vectors (rank 1), return
+    the (column, row) vectors such that pattern = column[:, None] * row.
+    Otherwise return None.
+    """
+    pattern = np.asarray(pattern, np.float64)
+    u, s, vt = np.linalg.svd(pattern)
+    if s[0] == 0 or np.any(s[1:] > tolerance * s[0]):
+        return(None)
+
+    norm = np.sqrt(s[0])
+    return(u[:, 0] * norm, vt[0] * norm)
+
+def convolve_separable(pixels, column, row):
     """
+    Apply the rank 1 pattern column[:, None] * row as two 1D passes,
+    first along the rows of the image then along its columns.
+    """
+    kh = len(column)
+    kw = len(row)
+    height = np.shape(pixels)[0] - kh + 1
+    width = np.shape(pixels)[1] - kw + 1
+
+    # Vertical pass, on all the columns of the image
+    vertical = np.zeros((height, np.shape(pixels)[1]), np.float64)
+    for p in range(kh):
+        vertical += column[p] * pixels[p:p + height, :]
 
-    for i in range(margin):
-        pixels = np.insert(pixels, 0, 0, axis=1)
+    # Horizontal pass
+    output = np.zeros((height, width), np.float64)
+    for q in range(kw):
+        output += row[q] * vertical[:, q:q + width]
 
-    top_bloc = np.array(margin*[len(pixels[0])*[0]])
-    pixels = np.concatenate((pixels, top_bloc), axis=0)
-    pixels = np.concatenate((top_bloc, pixels), axis=0)
+    return(output)
+
+# Beyond this number of pattern coefficients the FFT is cheaper than the direct sum.
+DIRECT_MAX_TERMS = 25
 
-    side_bloc = np.array(len(pixels)*[margin*[0]])
-    pixels = np.concatenate((pixels, side_bloc), axis=1)
+# Beyond this number of 1D coefficients (both passes) the FFT is cheaper
+# than the separable sum.
+SEPARABLE_MAX_TERMS = 18
 
-    return(pixels)
+# Images larger than this (in any dimension) are convolved by overlap-add tiles.
+FFT_BLOCK = 512
 
-def scan(pixels, margin, pattern):
+def choose_method(shape, pattern_shape, separable=False):
+    """
+    Pick the convolution backend for an image and a pattern of given shapes.
+    """
+    kh, kw = pattern_shape
+    if separable and kh + kw <= SEPARABLE_MAX_TERMS:
+        return('separable')
+    if kh * kw <= DIRECT_MAX_TERMS:
+        return('direct')
+    if max(shape) > FFT_BLOCK:
+        return('overlap-add')
+    return('fft')
+
+def convolve(pixels, pattern, method='auto'):
+    """
+    Apply the pattern on every position of the image where it fully fits.
+    method is 'direct', 'separable', 'fft', 'overlap-add' or 'auto'
+    (chosen from the sizes and from the rank of the pattern).
+    """
+    vectors = None
+    if method in ('auto', 'separable'):
+        vectors = separate(pattern)
+
+    if method == 'auto':
+        method = choose_method(np.shape(pixels), np.shape(pattern), vectors is not None)
+
+    if method == 'separable':
+        if vectors is None:
+            raise ValueError("Pattern is not separable")
+        return(convolve_separable(pixels, vectors[0], vectors[1]))
+    if method == 'direct':
+        return(convolve_direct(pixels, pattern))
+    if method == 'fft':
+        return(convolve_fft(pixels, pattern))
+    if method == 'overlap-add':
+        return(convolve_fft(pixels, pattern, FFT_BLOCK))
+
+    raise ValueError("Unknown convolution method : {}".format(method))
+
+def scan(pixels, margin, pattern, method='auto'):
     """
     Scan the original image and apply the pattern.
     """
-    shape = np.shape(pixels)
-    output = np.zeros((shape[0]-2*margin, shape[1]-2*margin), np.float)
-    # Looping over
-    for i in range(margin, len(pixels)-margin):
-        for j in range(margin, len(pixels[0])-margin):
-            # Create sub image 9x9 centered on pixel[i][j]
-            image = pixels[i-margin:i+margin+1, j-margin:j+margin+1]
-            output[i-margin, j-margin] = np.sum(image * pattern)
+    if np.shape(pattern) != (2*margin+1, 2*margin+1):
+        raise ValueError("Pattern shape {} does not match margin {}".format(np.shape(pattern), margin))
+
+    output = convolve(pixels, pattern, method)
 
     return(output)
 
@@ -77,49 +255,66 @@ def is_peak(x, i, j, threshold):
 
     return(okpeak)
 
-def peaks(pixels, margin, threshold):
+def find_peaks(pixels, margin, threshold):
     """
-    Returns list of all the peaks.
+    Whole array version of is_peak : a peak is strictly greater than its
+    8 neighbours and than the threshold.
+    The threshold is a number or an array of the shape of the image without the margin.
+    Returns the (row, column) indices of the peaks, without the margin,
+    as a (N, 2) array sorted by row then column.
     """
-    peaks = []
+    pixels = np.asarray(pixels)
+    height, width = np.shape(pixels)
+    center = pixels[margin:height - margin, margin:width - margin]
 
-    # Looping over all pixel of the image.
-    for i in range(margin, len(pixels) - margin):
-        for j in range(margin, len(pixels[0]) - margin):
-            if is_peak(pixels, i, j, threshold):
-                peaks.append([i-margin,j-margin])
+    mask = center > threshold
+    shifted = np.empty(center.shape, bool)
 
-    return(peaks)
+    # Compare the image with its 8 shifted copies
+    for p in range(-1, 2):
+        for q in range(-1, 2):
+            if p == 0 and q == 0:
+                continue
+            neighbour = pixels[margin + p:height - margin + p, margin + q:width - margin + q]
+            np.greater(center, neighbour, out=shifted)
+            mask &= shifted
 
-def complete_peaks_search(pixels):
+    return(np.argwhere(mask))
+
+def peaks(pixels, margin, threshold):
     """
-    From pixels; retunrs directly the list of peaks, going through convoluted imgage.
-    Result of ex3.
+    Returns the array of all the peaks.
+    """
+    return(find_peaks(pixels, margin, threshold))
+
+def convolve_image(pixels, size=9):
+    """
+    Convolve the image with the normalized Gaussian pattern of given size.
+    The image is extended with zeros so the result has the size of the image.
     """
 
-    # Build Gaussian pattern
-    pat = pattern(9)
+    # Build Gaussian pattern (without the print of pattern, the pipeline
+    # workers keep the standard output for the records)
+    pat = gaussian(size)
     sum_pat = np.sum(pat)
     pat = pat / sum_pat
 
     # Extend the image
-    extended = extend(pixels, 4)
+    margin = size // 2
+    extended = extend(pixels, margin)
 
     # Convoluted
-    conv = scan(extended, 4, pat)
-
-    # Extend the convolution image
-    conv_ext = extend(conv, 1)
-
-    # Identify the Peaks
-    thres = lib_background.threshold(pixels)
-    print(thres)
-    peaks_search = peaks(conv_ext, 1, thres)
-
-    return(peaks_search)
-
-
+    conv = scan(extended, margin, pat)
 
+    return(conv)
 
+def complete_peaks_search(pixels):
+    """
+    From pixels; retunrs directly the list of peaks, going through convoluted imgage.
+    The convoluted image and the threshold are shared with the other stages (see lib_frame).
+    Result of ex3.
+    """
 
+    peaks_search = lib_frame.analysis(pixels).peaks()
 
+    return(peaks_search)
@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 from npac import args
-from astropy.io import fits
 
 
 def init():
@@ -27,22 +26,121 @@ def init():
             interactive = False
     return(file_name, interactive)
 
+class FitsImage(object):
+    """ Lazy access to one image HDU (index or EXTNAME) of a FITS file.
+        The file is opened memory-mapped on first use, the header and the
+        pixels are only read when asked, and section() reads a rectangle
+        without loading the rest of the image.
+        Use it in a with statement (or call close) to release the file.
+        Note : frames with BZERO/BSCALE are scaled, hence fully read, by astropy
+        when pixels is accessed; section() does not have this limitation.
+    """
+
+    def __init__(self, file_name, hdu=0):
+        """
+        Define the file and the HDU, nothing is read yet.
+        """
+        self.file_name = file_name
+        self.hdu = hdu
+        self.fits_blocks = None
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return(False)
+
+    def open(self):
+        """
+        Open (once) the FITS file, memory-mapped.
+        """
+        if self.fits_blocks is None:
+            from astropy.io import fits
+            self.fits_blocks = fits.open(self.file_name, memmap=True)
+        return(self.fits_blocks)
+
+    def close(self):
+        """
+        Close the FITS file. Pixels already returned stay usable.
+        """
+        if self.fits_blocks is not None:
+            self.fits_blocks.close()
+            self.fits_blocks = None
+        return 0
+
+    @property
+    def block(self):
+        """ The HDU of the image. """
+        return(self.open()[self.hdu])
+
+    @property
+    def header(self):
+        """ Header of the image HDU. """
+        return(self.block.header)
+
+    @property
+    def pixels(self):
+        """ Pixels of the image HDU, memory-mapped when possible. """
+        return(self.block.data)
+
+    @property
+    def shape(self):
+        """ Shape of the image, from the header only. """
+        header = self.header
+        return(tuple(header['NAXIS{:d}'.format(axis)] for axis in range(header['NAXIS'], 0, -1)))
+
+    def section(self, rows, columns):
+        """
+        Read only the pixels[rows, columns] rectangle (rows and columns are slices).
+        """
+        return(self.block.section[rows, columns])
+
+def image_hdus(file_name, extnames=None):
+    """
+    Return the indices of the 2D image HDUs of a FITS file,
+    only those whose EXTNAME is in extnames if given. Only headers are read.
+    """
+    from astropy.io import fits
+
+    indices = []
+    with fits.open(file_name, memmap=True) as fits_blocks:
+        for index, block in enumerate(fits_blocks):
+            if not block.is_image or block.header.get('NAXIS', 0) != 2:
+                continue
+            if extnames is not None and block.name not in extnames:
+                continue
+            indices.append(index)
+    return(indices)
+
+def iter_images(file_name, extnames=None):
+    """
+    Yield (header, pixels) for each 2D image HDU of a FITS file (see image_hdus),
+    reading each HDU only when it is reached. The file is closed once all
+    the images have been yielded.
+    """
+    from astropy.io import fits
+
+    with fits.open(file_name, memmap=True) as fits_blocks:
+        for index in image_hdus(file_name, extnames):
+            block = fits_blocks[index]
+            yield block.header, block.data
+
 def read_first_image(file_name):
     """
     Return header and pixels of a .fits file_name.
     """
     pixels = None
     try : # open file_name
-        with fits.open(file_name) as fits_blocks:
-            block = fits_blocks[0]
-            pixels = block.data
-            header = block.header
-    except IOError:
-        print("Error while opening/reading file !")
-        exit()
+        with FitsImage(file_name) as image:
+            pixels = image.pixels
+            header = image.header
     except FileNotFoundError:
         print("Error with file name")
         exit()
+    except IOError:
+        print("Error while opening/reading file !")
+        exit()
 
 
-    return header, pixels
\ No newline at end of file
+    return header, pixels
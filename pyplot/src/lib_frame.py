@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import collections
+import threading
+import lib_background
+import lib_conv
+import lib_cluster
+
+# Number of frames whose derived products are kept in memory.
+MAX_FRAMES = 4
+
+frames = collections.OrderedDict()
+frames_lock = threading.Lock()
+
+
+class FrameAnalysis(object):
+    """ Products derived from the pixels of one frame :
+        - histogram,
+        - background fit and threshold,
+        - tiled background maps,
+        - convoluted image,
+        - peaks,
+        - integral image.
+        Each product is computed on first use then reused by all the stages.
+        The pixels must not be modified once analysed.
+    """
+
+    def __init__(self, pixels):
+        """
+        Define the frame, no product is computed yet.
+        """
+        self.pixels = pixels
+        self.products = {}
+
+    def product(self, name, compute):
+        """
+        Return the named product, calling compute() only the first time.
+        """
+        if name not in self.products:
+            self.products[name] = compute()
+        return(self.products[name])
+
+    def histogram(self, nbins=200):
+        """
+        Bin values and bin boundaries of the pixels histogram.
+        """
+        return(self.product(('histogram', nbins), lambda: lib_background.histogram(self.pixels, nbins)))
+
+    def background(self, method='fit'):
+        """
+        BackgroundResult of the frame (see lib_background.estimate_background),
+        histogram methods share the 200 bins histogram.
+        """
+        def compute():
+            if method in lib_background.PIXELS_METHODS:
+                return(lib_background.background_from_pixels(self.pixels, method=method))
+            integer = self.pixels.dtype.kind in 'iu'
+            return(lib_background.background_from_histogram(*self.histogram(200), method=method,
+                                                            integer=integer))
+        return(self.product(('background', method), compute))
+
+    def threshold(self):
+        """
+        Background threshold of the frame (see lib_background.threshold).
+        """
+        return(self.background().threshold)
+
+    def background_map(self, tile=64):
+        """
+        Tiled background, rms and threshold maps (see lib_background.background_map).
+        """
+        return(self.product(('background_map', tile), lambda: lib_background.background_map(self.pixels, tile)))
+
+    def convolved(self):
+        """
+        Image convoluted with the Gaussian pattern (see lib_conv.convolve_image).
+        """
+        return(self.product('convolved', lambda: lib_conv.convolve_image(self.pixels)))
+
+    def peaks(self, tile=None):
+        """
+        Peaks of the convoluted image above the threshold,
+        or above the tiled background map threshold if tile is given.
+        """
+        def compute():
+            if tile is None:
+                thres = self.threshold()
+            else:
+                thres = self.background_map(tile).threshold
+            conv_ext = lib_conv.extend(self.convolved(), 1)
+            return(lib_conv.peaks(conv_ext, 1, thres))
+        return(self.product(('peaks', tile), compute))
+
+    def integral(self):
+        """
+        Summed-area table of the pixels (see lib_cluster.integral_image).
+        """
+        return(self.product('integral', lambda: lib_cluster.integral_image(self.pixels)))
+
+
+def analysis(pixels):
+    """
+    Return the FrameAnalysis of this pixels buffer, creating it on first use.
+    Only the MAX_FRAMES most recently used frames are remembered.
+    """
+    key = id(pixels)
+    with frames_lock:
+        frame = frames.get(key)
+        # The frame keeps a reference to its pixels, so the id cannot be reused while cached.
+        if frame is None or frame.pixels is not pixels:
+            frame = FrameAnalysis(pixels)
+            frames[key] = frame
+            if len(frames) > MAX_FRAMES:
+                frames.popitem(last=False)
+        else:
+            frames.move_to_end(key)
+    return(frame)
+
+def forget(pixels=None):
+    """
+    Drop the products of the given pixels buffer, or of all frames.
+    """
+    with frames_lock:
+        if pixels is None:
+            frames.clear()
+        else:
+            frames.pop(id(pixels), None)
+    return 0
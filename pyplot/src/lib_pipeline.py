@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import concurrent.futures
+import contextlib
+import sys
+import traceback
+import lib_fits
+import lib_frame
+import lib_cluster
+import lib_stars
+
+
+def process_frame(header, pixels, tile=None):
+    """
+    Run the whole pipeline on one frame : background, peaks, clusters
+    and their RA/Dec coordinates.
+    Returns a record (dictionary of plain numbers and lists) with the
+    background fit and the clusters sorted by decreasing luminosity.
+    """
+    frame = lib_frame.analysis(pixels)
+    background = frame.background()
+
+    clusters = lib_cluster.find_clusters(pixels, tile=tile)
+
+    # Fill the RA/Dec columns of the catalog
+    lib_stars.fill_radec(clusters, header)
+
+    record = {
+        'background': float(background.background),
+        'dispersion': float(background.dispersion),
+        'threshold': float(background.threshold),
+        'clusters_number': len(clusters),
+        'clusters': [{'row': int(c.coord[0]), 'column': int(c.coord[1]),
+                      'lum': c.lum.item(), 'ext': int(c.ext), 'lumpeak': c.lumpeak.item(),
+                      'ra': float(c.ra), 'dec': float(c.dec)} for c in clusters],
+    }
+
+    # The products of this frame will not be used again
+    lib_frame.forget(pixels)
+
+    return(record)
+
+def process_extension(file_name, hdu, tile=None):
+    """
+    Process one image HDU of a FITS file (see process_frame),
+    the record also gives the file name, the HDU index and its EXTNAME.
+    """
+    with lib_fits.FitsImage(file_name, hdu) as image:
+        record = process_frame(image.header, image.pixels, tile)
+        record['file'] = file_name
+        record['hdu'] = hdu
+        record['extname'] = image.block.name
+    return(record)
+
+def process_extensions(file_name, extnames=None, tile=None, processes=None):
+    """
+    Process all the image HDUs of a multi-extension FITS file (or those
+    whose EXTNAME is in extnames) in parallel worker processes.
+    Each worker opens the file itself, so no pixels are sent between processes.
+    Returns the list of records, in the order of the HDUs.
+    """
+    indices = lib_fits.image_hdus(file_name, extnames)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(process_extension, file_name, index, tile) for index in indices]
+        return([future.result() for future in futures])
+
+def process_file(file_name, tile=None):
+    """
+    Process all the image HDUs of a FITS file, one after the other.
+    Returns the list of records; a file that cannot be processed gives a
+    single record with its error message instead of stopping the batch.
+    The messages printed by the libraries go to the standard error, the
+    standard output of the batch being kept for the records.
+    """
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            return([process_extension(file_name, index, tile) for index in lib_fits.image_hdus(file_name)])
+    except Exception as error:
+        return([{'file': file_name, 'error': '{}: {}'.format(type(error).__name__, error),
+                 'traceback': traceback.format_exc()}])
+
+def process_files(file_names, tile=None, processes=None):
+    """
+    Process a list of FITS files in parallel worker processes (see process_file).
+    Yields the records of each file, in the order of file_names, as soon as available.
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        for records in executor.map(process_file, file_names, [tile] * len(file_names)):
+            for record in records:
+                yield record
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import importlib
+
+
+def pyplot():
+    """
+    Return matplotlib.pyplot, imported on first use only :
+    batch (non interactive) runs never import matplotlib.
+    """
+    return(importlib.import_module('matplotlib.pyplot'))
+
+def show_image(pixels):
+    """
+    Display a 2D array.
+    """
+    plt = pyplot()
+    fig, main_axes = plt.subplots()
+    main_axes.imshow(pixels)
+    plt.show()
+
+    return 0
+
+def show_histogram(x1, y1, y2):
+    """
+    Plot the original histogram and its fit.
+    """
+    plt = pyplot()
+    fig, main_axes = plt.subplots()
+    plt.plot(x1, y1, 'b+:', label='data')
+    plt.plot(x1, y2, 'r.:', label='fit')
+
+    plt.xlabel("Amplitude", fontsize=16)
+    plt.ylabel("Frequency", fontsize=16)
+    plt.title("Flux distribution", fontsize=20)
+
+    plt.legend()
+
+
+    plt.show()
+
+    return 0
+
+def show_clusters(pixels, clusters):
+    """
+    Display the image and draw a square around each cluster.
+    """
+    plt = pyplot()
+    fig, main_axes = plt.subplots()
+    main_axes.imshow(pixels)
+
+    # Draws clusters arround peaks.
+    for i in range(len(clusters)):
+        xleft = clusters[i].coord[0]-clusters[i].ext
+        xright =  clusters[i].coord[0] + clusters[i].ext
+        ybottom = clusters[i].coord[1]-clusters[i].ext
+        ytop = clusters[i].coord[1] + clusters[i].ext
+        squarex = [xleft, xright, xright, xleft, xleft]
+        squarey = [ybottom, ybottom, ytop, ytop, ybottom]
+        plt.plot(squarey, squarex, 'r--')
+
+    plt.show()
+
+    return 0
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import numpy as np
 from npac import stars
 from npac import coordinates
 
@@ -17,11 +18,36 @@ def get_radec(i,j, header, pixels):
     """
 
     my_wcs = coordinates.get_wcs(header)
-    x = conversion(i,j, pixels)[0]
-    y = conversion(i,j, pixels)[1]
+    x, y = conversion(i,j, pixels)
     radec = coordinates.xy_to_radec(my_wcs, coordinates.PixelXY(x,y))
     return(radec)
 
+def get_radec_many(rows, columns, header, approximate=False, directory=None):
+    """
+    Obtain the radec coordinates of many pixels (2d array coordinates rows, columns)
+    with a single WCS transformation. Returns an (N, 2) array of ra, dec.
+    With approximate=True, interpolate the coordinate grid of the WCS instead
+    (see coordinates.get_coordinate_grid, saved in directory if given).
+    """
+
+    # (i, j) -> (x, y) = (j, i), as in conversion()
+    xy = np.column_stack((np.asarray(columns, np.float64), np.asarray(rows, np.float64)))
+    if approximate:
+        grid = coordinates.get_coordinate_grid(header, directory=directory)
+        return(coordinates.grid_xy_to_radec(grid, xy))
+    my_wcs = coordinates.get_wcs(header)
+    return(coordinates.xy_to_radec_many(my_wcs, xy))
+
+def fill_radec(catalog, header, approximate=False, directory=None):
+    """
+    Fill the ra/dec columns of a cluster catalog from its coord_row/coord_col columns.
+    """
+
+    radec = get_radec_many(catalog['coord_row'], catalog['coord_col'], header, approximate, directory)
+    catalog.data['ra'] = radec[:, 0]
+    catalog.data['dec'] = radec[:, 1]
+    return(catalog)
+
 def cluster_radec(clusters, i, header, pixels):
     """
     Take a cluster and extract radec coordinates from 2d array coordinates (i,j).
@@ -36,16 +62,34 @@ def cluster_radec(clusters, i, header, pixels):
     print(signature_fmt_2)
     return(cluster_radec)
 
-def celestial_objects(cluster_radec, i):
+def celestial_objects(cluster_radec, i, objects=None):
     """
-    Extract celestial objects in cluster
+    Extract celestial objects in cluster (objects: those already retrieved from SIMBAD).
     """
 
-    celestial_objects = stars.get_celestial_objects(cluster_radec)
+    if objects is None:
+        objects = stars.get_celestial_objects(cluster_radec)[0]
 
     # Loop over all celestial objects in one cluster.
-    for j in range(len(celestial_objects[0])):
-        signature_fmt_3 = 'RESULT: celestial_object_{:02d}_{:02d} = {:s}'.format(i, j, list(celestial_objects[0].keys())[j])
+    for j in range(len(objects)):
+        signature_fmt_3 = 'RESULT: celestial_object_{:02d}_{:02d} = {:s}'.format(i, j, list(objects.keys())[j])
         print(signature_fmt_3)
 
+    return(0)
+
+def clusters_celestial_objects(clusters, number, header):
+    """
+    Print the radec coordinates and the celestial objects of the first clusters,
+    SIMBAD being queried for all of them in batches.
+    """
+
+    fill_radec(clusters, header)
+    radecs = [coordinates.RaDec(clusters[i].ra, clusters[i].dec) for i in range(number)]
+    objects = stars.get_celestial_objects_many(radecs)
+
+    for i in range(number):
+        print('RESULT: right_ascension_{:02d} = {:.3f}'.format(i, radecs[i].ra))
+        print('RESULT: declination_{:02d} = {:.3f}'.format(i, radecs[i].dec))
+        celestial_objects(radecs[i], i, objects[i])
+
     return(0)
\ No newline at end of file
@@ -2,10 +2,11 @@
 # -*- coding: utf-8 -*-
 """args module"""
 import argparse
+import glob
 import os
 import sys
 
-from typing import Tuple
+from typing import List, Tuple
 
 def get_default_data_path() -> str:
     """ Etablish the default path and file values
@@ -98,6 +99,46 @@ def get_args() -> Tuple[str, bool]:
 
     return data_file, not args.batch
 
+def get_data_files(pattern: str) -> List[str]:
+    """ Resolve a directory or a glob pattern into the list of FITS files
+    to process, in alphabetical order.
+    As in get_args, a pattern without an explicit path is looked for in the
+    default data path, and '.fits' is appended to a plain file name.
+
+    Parameters
+    ---------
+    pattern : str
+        Directory (all its *.fits files), glob pattern or file name.
+
+    Returns
+    ---------
+    data_files : list of str
+        Names (including path) of the FITS files.
+
+    Examples
+    ---------
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> for name in ('b.fits', 'a.fits', 'c.txt'):
+    ...     open(os.path.join(directory, name), 'w').close()
+    >>> [os.path.basename(f) for f in get_data_files(directory)]
+    ['a.fits', 'b.fits']
+    >>> [os.path.basename(f) for f in get_data_files(os.path.join(directory, 'b'))]
+    ['b.fits']
+    """
+    if pattern.rfind('/') == -1 and pattern.rfind('\\') == -1:
+        # when an explicit path is not provided, prepend the default path
+        pattern = get_default_data_path() + '/' + pattern
+
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.fits')
+    elif not glob.has_magic(pattern) and not pattern.endswith('.fits'):
+        # we need *.fits files
+        pattern += '.fits'
+
+    return sorted(glob.glob(pattern))
+
+
 def _tests():
     """ Unit tests for args.py To run the test, execute:
 
@@ -5,12 +5,19 @@ Utilities for the world coordinate system
 """
 
 import collections
+import hashlib
+import os
+import re
+import threading
 import numpy as np
 import warnings
 
-from astropy.wcs import WCS
-from astropy.io import fits
-from astropy.io.fits.header import Header
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # astropy is slow to import: only get_wcs needs it at run time
+    from astropy.wcs import WCS
+    from astropy.io.fits.header import Header
 
 warnings.filterwarnings('ignore', category=Warning, append=True)
 
@@ -23,17 +30,102 @@ PixelXY = collections.namedtuple('PixelXY', ['x', 'y'])
 RaDec = collections.namedtuple('RaDec', ['ra', 'dec'])
 
 
+# ======
+# Cache of the parsed WCS objects
+# * keyed by a fingerprint of the WCS keywords of the header
+# * bounded size, the least recently used WCS is dropped first
+# =====
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'size', 'maxsize'])
+
+# Number of parsed WCS objects kept in memory.
+WCS_CACHE_SIZE = 16
+
+# Header keywords which define the world coordinate system
+# (axes, reference point, linear transformation, projection parameters,
+# SIP distortion, reference frame and date).
+WCS_KEYWORDS = re.compile(r'^(NAXIS\d*|WCSAXES\w?|CTYPE\d+\w?|CUNIT\d+\w?|CRPIX\d+\w?'
+                          r'|CRVAL\d+\w?|CDELT\d+\w?|CROTA\d+|CD\d+_\d+\w?|PC\d+_\d+\w?'
+                          r'|PV\d+_\d+\w?|PS\d+_\d+\w?|LONPOLE\w?|LATPOLE\w?|RADESYS\w?|RADECSYS'
+                          r'|EQUINOX\w?|EPOCH|MJD-OBS|DATE-OBS|(A|B|AP|BP)_(ORDER|DMAX|\d+_\d+))$')
+
+_wcs_cache = collections.OrderedDict()
+_wcs_cache_lock = threading.Lock()
+_wcs_cache_hits = 0
+_wcs_cache_misses = 0
+
+
+def wcs_fingerprint(fits_header: 'Header') -> str:
+    """Stable fingerprint of the WCS keywords of a FITS header
+
+    Only the keywords matching WCS_KEYWORDS are used, in sorted order,
+    so two headers with the same WCS have the same fingerprint
+    whatever their other keywords.
+
+    Parameters
+    ----------
+    fits_header : astropy.io.fits.header.Header (or dict)
+        Header from a FITS HDU image
+
+    Returns
+    ----------
+    out : str
+        hexadecimal SHA-1 digest of the WCS keywords and their values
+
+    Examples
+    ----------
+    >>> header = {'CRVAL1': 10.0, 'CRVAL2': -20.0, 'OBJECT': 'M31'}
+    >>> other = {'CRVAL2': -20.0, 'CRVAL1': 10.0, 'EXPTIME': 30.0}
+    >>> print(wcs_fingerprint(header) == wcs_fingerprint(other))
+    True
+    >>> other['CRVAL1'] = 10.5
+    >>> print(wcs_fingerprint(header) == wcs_fingerprint(other))
+    False
+    """
+    keywords = sorted((key, repr(value)) for key, value in fits_header.items()
+                      if WCS_KEYWORDS.match(key))
+    return hashlib.sha1(repr(keywords).encode('utf-8')).hexdigest()
+
+
+def wcs_cache_info() -> CacheInfo:
+    """Hits, misses and size of the WCS cache
+
+    Examples
+    ----------
+    >>> wcs_cache_clear()
+    >>> print(wcs_cache_info())
+    CacheInfo(hits=0, misses=0, size=0, maxsize=16)
+    """
+    with _wcs_cache_lock:
+        return CacheInfo(_wcs_cache_hits, _wcs_cache_misses, len(_wcs_cache), WCS_CACHE_SIZE)
+
+
+def wcs_cache_clear() -> None:
+    """Empty the WCS cache and reset its counters"""
+    global _wcs_cache_hits, _wcs_cache_misses
+
+    with _wcs_cache_lock:
+        _wcs_cache.clear()
+        _wcs_cache_hits = 0
+        _wcs_cache_misses = 0
+
+
 # ======
 # Information for a given image
 # =====
 
-def get_wcs(fits_header: Header) -> WCS:
+def get_wcs(fits_header: 'Header', cache: bool = True) -> 'WCS':
     """Parse the WCS keywords from a FITS image header
 
+    The parsed objects are cached by wcs_fingerprint(): headers with
+    the same WCS keywords share the same WCS object, which must therefore
+    not be modified by the caller.
+
     Parameters
     ----------
     fits_header : astropy.io.fits.header.Header
         Header from a FITS HDU image
+    cache : bool
+        False to always parse the header (the cache is left untouched)
 
     Returns
     ----------
@@ -53,14 +145,45 @@ def get_wcs(fits_header: Header) -> WCS:
     Take the header of the first HDU
     >>> header = data[0].header
     >>> assert(type(header) == Header)
+
+    The second parse of the same header comes from the cache
+    >>> wcs_cache_clear()
+    >>> wcs_object = get_wcs(header)
+    >>> print(get_wcs(header) is wcs_object)
+    True
+    >>> print(wcs_cache_info())
+    CacheInfo(hits=1, misses=1, size=1, maxsize=16)
     """
-    return WCS(fits_header)
+    global _wcs_cache_hits, _wcs_cache_misses
+    from astropy.wcs import WCS
+
+    if not cache:
+        return WCS(fits_header)
+
+    key = wcs_fingerprint(fits_header)
+    with _wcs_cache_lock:
+        if key in _wcs_cache:
+            _wcs_cache.move_to_end(key)
+            _wcs_cache_hits += 1
+            return _wcs_cache[key]
+        _wcs_cache_misses += 1
+
+    # Parse outside the lock, other threads may use the cache meanwhile
+    wcs_object = WCS(fits_header)
+
+    with _wcs_cache_lock:
+        wcs_object = _wcs_cache.setdefault(key, wcs_object)
+        _wcs_cache.move_to_end(key)
+        while len(_wcs_cache) > WCS_CACHE_SIZE:
+            _wcs_cache.popitem(last=False)
+
+    return wcs_object
 
 
 # =====
 # Converters
 # =====
-def xy_to_radec(wcs_object: WCS, pxy: PixelXY) -> RaDec:
+def xy_to_radec(wcs_object: 'WCS', pxy: PixelXY) -> RaDec:
     """ Convert the x/y coordinates of an image pixel
     into the ra/dec coordinates of a celestial body
 
@@ -93,12 +216,12 @@ def xy_to_radec(wcs_object: WCS, pxy: PixelXY) -> RaDec:
     >>> print(type(radec) == RaDec)
     True
     """
-    pixel = np.array([[pxy.x, pxy.y], ], np.float_)
+    pixel = np.array([[pxy.x, pxy.y], ], np.float64)
     sky = wcs_object.wcs_pix2world(pixel, 0)
     return RaDec(ra=sky[0][0], dec=sky[0][1])
 
 
-def radec_to_xy(wcs_object: WCS, rd: RaDec) -> PixelXY:
+def radec_to_xy(wcs_object: 'WCS', rd: RaDec) -> PixelXY:
     """ Convert the ra/dec coordinates of a celestial body
     into the x/y coordinates of an image pixel.
 
@@ -139,10 +262,358 @@ def radec_to_xy(wcs_object: WCS, rd: RaDec) -> PixelXY:
     >>> print(np.array(pxy, dtype=int))
     [736 806]
     """
-    coord = np.array([[rd.ra, rd.dec], ], np.float_)
+    coord = np.array([[rd.ra, rd.dec], ], np.float64)
     result = wcs_object.wcs_world2pix(coord, 0)
     return PixelXY(x=result[0][0], y=result[0][1])
 
+
+def xy_to_radec_many(wcs_object: 'WCS', xy: np.ndarray) -> np.ndarray:
+    """ Convert the x/y coordinates of many image pixels
+    into ra/dec coordinates, with a single WCS transformation
+
+    Parameters
+    ----------
+    wcs_object: Instance of WCS
+        a wcs object, as returned by get_wcs()
+    xy: array_like of shape (N, 2)
+        x/y positions in an image, one pixel per row
+
+    Returns
+    ----------
+    out : numpy array of shape (N, 2)
+        ra/dec positions in the sky (degrees), one pixel per row.
+
+    Examples
+    ----------
+    >>> data = fits.open(fits_path)
+    >>> wcs_object = get_wcs(data[0].header)
+
+    Same result as xy_to_radec, pixel by pixel
+    >>> xy = np.array([[0.0, 0.0], [10.0, 20.0], [99.0, 149.0]])
+    >>> radec = xy_to_radec_many(wcs_object, xy)
+    >>> print(radec.shape)
+    (3, 2)
+    >>> one = xy_to_radec(wcs_object, PixelXY(10.0, 20.0))
+    >>> print(np.allclose(radec[1], one))
+    True
+
+    No pixel, no conversion
+    >>> print(xy_to_radec_many(wcs_object, np.empty((0, 2))).shape)
+    (0, 2)
+    """
+    pixels = np.asarray(xy, np.float64).reshape(-1, 2)
+    if len(pixels) == 0:
+        return np.empty((0, 2), np.float64)
+    return np.asarray(wcs_object.wcs_pix2world(pixels, 0), np.float64)
+
+
+def radec_to_xy_many(wcs_object: 'WCS', radec: np.ndarray) -> np.ndarray:
+    """ Convert the ra/dec coordinates of many celestial bodies
+    into x/y image coordinates, with a single WCS transformation
+
+    Parameters
+    ----------
+    wcs_object: Instance of WCS
+        a wcs object, as returned by get_wcs()
+    radec: array_like of shape (N, 2)
+        ra/dec positions in the sky (degrees), one body per row
+
+    Returns
+    ----------
+    out : numpy array of shape (N, 2)
+        x/y positions in the image, one body per row.
+
+    Examples
+    ----------
+    >>> data = fits.open(fits_path)
+    >>> header = data[0].header
+    >>> wcs_object = get_wcs(header)
+
+    Round trip through the sky coordinates
+    >>> xy = np.array([[0.0, 0.0], [10.0, 20.0], [99.0, 149.0]])
+    >>> back = radec_to_xy_many(wcs_object, xy_to_radec_many(wcs_object, xy))
+    >>> print(np.allclose(back, xy))
+    True
+
+    >>> radec = np.array([[header['CRVAL1'], header['CRVAL2']]])
+    >>> print(radec_to_xy_many(wcs_object, radec).astype(int))
+    [[736 806]]
+    """
+    coord = np.asarray(radec, np.float64).reshape(-1, 2)
+    if len(coord) == 0:
+        return np.empty((0, 2), np.float64)
+    return np.asarray(wcs_object.wcs_world2pix(coord, 0), np.float64)
+
+
+# =====
+# Interpolated coordinate grid
+# * exact ra/dec computed once on a coarse mesh of pixels
+# * bilinear interpolation between the nodes of the mesh
+# * reused for every frame with the same WCS fingerprint
+# =====
+CoordinateGrid = collections.namedtuple('CoordinateGrid',
+                                        ['fingerprint', 'x', 'y', 'ra', 'dec', 'max_error', 'step'])
+
+# Default distance in pixels between the nodes of a coordinate grid.
+GRID_STEP = 32
+
+# Number of coordinate grids kept in memory.
+GRID_CACHE_SIZE = 16
+
+_grid_cache = collections.OrderedDict()
+_grid_cache_lock = threading.Lock()
+
+
+def _grid_nodes(size: int, step: int) -> np.ndarray:
+    """Pixel positions of the grid nodes along one axis: every step pixels,
+    the last pixel (size - 1) always being a node"""
+    return np.unique(np.append(np.arange(0, size - 1, step), size - 1)).astype(np.float64)
+
+
+def _interpolate(grid: CoordinateGrid, xy: np.ndarray) -> np.ndarray:
+    """Bilinear interpolation of the grid ra/dec at the (N, 2) positions xy"""
+    x = xy[:, 0]
+    y = xy[:, 1]
+    nx = len(grid.x)
+    ny = len(grid.y)
+    # The nodes are regularly spaced (but the last one): index of the cell by division
+    step_x = grid.x[1] - grid.x[0] if nx > 1 else 1.0
+    step_y = grid.y[1] - grid.y[0] if ny > 1 else 1.0
+    ix = np.clip((x * (1.0 / step_x)).astype(np.intp), 0, max(nx - 2, 0))
+    iy = np.clip((y * (1.0 / step_y)).astype(np.intp), 0, max(ny - 2, 0))
+    # Next node along each axis (none if the axis has a single node)
+    jx = 1 if nx > 1 else 0
+    jy = 1 if ny > 1 else 0
+    tx = (x - grid.x[ix]) / np.maximum(grid.x[ix + jx] - grid.x[ix], 1.0)
+    ty = (y - grid.y[iy]) / np.maximum(grid.y[iy + jy] - grid.y[iy], 1.0)
+
+    # Bilinear weights of the four corners of each cell, gathered in the flattened nodes
+    corner = iy * nx + ix
+    dx = jx
+    dy = jy * nx
+    weights = ((1 - tx) * (1 - ty), tx * (1 - ty), (1 - tx) * ty, tx * ty)
+    result = np.empty((len(xy), 2), np.float64)
+    for k, values in enumerate((grid.ra.ravel(), grid.dec.ravel())):
+        result[:, k] = (weights[0] * np.take(values, corner) + weights[1] * np.take(values, corner + dx)
+                        + weights[2] * np.take(values, corner + dy) + weights[3] * np.take(values, corner + dx + dy))
+
+    # The ra nodes are stored unwrapped, back to [0, 360)
+    result[:, 0] %= 360.0
+    return result
+
+
+def _separation(radec1: np.ndarray, radec2: np.ndarray) -> np.ndarray:
+    """Small angular distances (arcsec) between two (N, 2) arrays of ra/dec"""
+    dra = (radec1[:, 0] - radec2[:, 0] + 180.0) % 360.0 - 180.0
+    ddec = radec1[:, 1] - radec2[:, 1]
+    return np.hypot(dra * np.cos(np.radians(radec2[:, 1])), ddec) * 3600.0
+
+
+def build_coordinate_grid(wcs_object: 'WCS', shape: tuple, step: int = GRID_STEP,
+                          fingerprint: str = '') -> CoordinateGrid:
+    """Compute the exact ra/dec of a coarse mesh of pixels
+
+    The ra/dec are computed with one wcs_pix2world call on the nodes
+    (every step pixels and the image borders). The ra are unwrapped around
+    the first node so that frames crossing ra = 0 interpolate correctly
+    (the frame must span less than 180 degrees in ra).
+
+    The error of the bilinear interpolation is largest at the centres
+    of the cells: it is measured there against the exact transform,
+    and stored in max_error (arcsec).
+
+    Parameters
+    ----------
+    wcs_object: Instance of WCS
+        a wcs object, as returned by get_wcs()
+    shape: tuple
+        (rows, columns) of the image
+    step: int
+        distance in pixels between the nodes of the grid
+    fingerprint: str
+        WCS fingerprint stored with the grid, as returned by wcs_fingerprint()
+
+    Returns
+    ----------
+    out : CoordinateGrid
+        nodes x (columns) and y (rows), ra and dec of the nodes (2d arrays),
+        maximum interpolation error in arcsec, and the step of the nodes
+
+    Examples
+    ----------
+    >>> data = fits.open(fits_path)
+    >>> wcs_object = get_wcs(data[0].header)
+    >>> grid = build_coordinate_grid(wcs_object, data[0].data.shape, step=16)
+    >>> print(grid.ra.shape)
+    (11, 8)
+    >>> print(grid.max_error < 0.01)
+    True
+    """
+    x = _grid_nodes(shape[1], step)
+    y = _grid_nodes(shape[0], step)
+    xx, yy = np.meshgrid(x, y)
+    radec = xy_to_radec_many(wcs_object, np.column_stack((xx.ravel(), yy.ravel())))
+
+    ra = radec[:, 0].reshape(xx.shape)
+    ra = ra[0, 0] + (ra - ra[0, 0] + 180.0) % 360.0 - 180.0
+    dec = radec[:, 1].reshape(xx.shape)
+    grid = CoordinateGrid(fingerprint, x, y, ra, dec, 0.0, step)
+
+    # Error measured at the centres of the cells (and of the nodes if there is a single cell)
+    cx = (x[:-1] + x[1:]) / 2.0 if len(x) > 1 else x
+    cy = (y[:-1] + y[1:]) / 2.0 if len(y) > 1 else y
+    cxx, cyy = np.meshgrid(cx, cy)
+    centres = np.column_stack((cxx.ravel(), cyy.ravel()))
+    errors = _separation(_interpolate(grid, centres), xy_to_radec_many(wcs_object, centres))
+
+    return grid._replace(max_error=float(errors.max()))
+
+
+def grid_xy_to_radec(grid: CoordinateGrid, xy: np.ndarray) -> np.ndarray:
+    """Approximate conversion of the x/y coordinates of many image pixels
+    into ra/dec, by interpolation of a coordinate grid
+
+    The error is at most about grid.max_error arcsec inside the image.
+
+    Parameters
+    ----------
+    grid: CoordinateGrid
+        as returned by build_coordinate_grid() or get_coordinate_grid()
+    xy: array_like of shape (N, 2)
+        x/y positions in the image, one pixel per row
+
+    Returns
+    ----------
+    out : numpy array of shape (N, 2)
+        ra/dec positions in the sky (degrees), one pixel per row.
+
+    Examples
+    ----------
+    >>> data = fits.open(fits_path)
+    >>> wcs_object = get_wcs(data[0].header)
+    >>> grid = build_coordinate_grid(wcs_object, data[0].data.shape, step=16)
+
+    The nodes are exact
+    >>> xy = np.array([[16.0, 32.0], [30.5, 41.2]])
+    >>> exact = xy_to_radec_many(wcs_object, xy)
+    >>> approx = grid_xy_to_radec(grid, xy)
+    >>> print(np.allclose(approx[0], exact[0]))
+    True
+    >>> print(_separation(approx, exact).max() <= grid.max_error)
+    True
+    """
+    pixels = np.asarray(xy, np.float64).reshape(-1, 2)
+    if len(pixels) == 0:
+        return np.empty((0, 2), np.float64)
+    return _interpolate(grid, pixels)
+
+
+def save_coordinate_grid(grid: CoordinateGrid, directory: str) -> str:
+    """Save a coordinate grid in directory (numpy .npz file named after
+    its fingerprint, image size and step), returns the file name"""
+    os.makedirs(directory, exist_ok=True)
+    shape = (int(grid.y[-1]) + 1, int(grid.x[-1]) + 1)
+    file_name = _grid_file_name(directory, grid.fingerprint, shape, grid.step)
+    np.savez(file_name, fingerprint=np.array(grid.fingerprint), x=grid.x, y=grid.y,
+             ra=grid.ra, dec=grid.dec, max_error=np.array(grid.max_error), step=np.array(grid.step))
+    return file_name
+
+
+def _grid_file_name(directory: str, fingerprint: str, shape: tuple, step: int) -> str:
+    """File name of a coordinate grid: fingerprint, image size and step of the nodes"""
+    return os.path.join(directory, 'grid_{}_{}x{}_step{}.npz'.format(
+        fingerprint, int(shape[0]), int(shape[1]), int(step)))
+
+
+def load_coordinate_grid(file_name: str) -> CoordinateGrid:
+    """Read a coordinate grid saved by save_coordinate_grid()"""
+    with np.load(file_name) as saved:
+        return CoordinateGrid(str(saved['fingerprint']), saved['x'], saved['y'],
+                              saved['ra'], saved['dec'], float(saved['max_error']), int(saved['step']))
+
+
+def get_coordinate_grid(fits_header: 'Header', shape: tuple = None, step: int = GRID_STEP,
+                        directory: str = None) -> CoordinateGrid:
+    """Coordinate grid of the WCS of a FITS header, built once per WCS fingerprint
+
+    The grid is looked up in memory, then in directory (if given),
+    and only built when it is found in neither (then saved in directory).
+
+    Parameters
+    ----------
+    fits_header : astropy.io.fits.header.Header
+        Header from a FITS HDU image
+    shape: tuple
+        (rows, columns) of the image, by default (NAXIS2, NAXIS1)
+    step: int
+        distance in pixels between the nodes of the grid
+    directory: str
+        where the grids are persisted, None to keep them in memory only
+
+    Returns
+    ----------
+    out : CoordinateGrid
+
+    Examples
+    ----------
+    >>> import tempfile
+    >>> header = fits.open(fits_path)[0].header
+    >>> directory = tempfile.mkdtemp()
+    >>> grid = get_coordinate_grid(header, directory=directory)
+    >>> print(len(os.listdir(directory)))
+    1
+
+    The same WCS gives the same grid, from memory or from the disk
+    >>> print(get_coordinate_grid(header, directory=directory) is grid)
+    True
+    >>> _grid_cache.clear()
+    >>> print(np.array_equal(get_coordinate_grid(header, directory=directory).ra, grid.ra))
+    True
+
+    Another step gives another grid (and file)
+    >>> other = get_coordinate_grid(header, step=30, directory=directory)
+    >>> print(other.step, len(os.listdir(directory)))
+    30 2
+    >>> _grid_cache.clear()
+    >>> print(get_coordinate_grid(header, step=30, directory=directory).max_error == other.max_error)
+    True
+    """
+    if shape is None:
+        shape = (fits_header['NAXIS2'], fits_header['NAXIS1'])
+    fingerprint = wcs_fingerprint(fits_header)
+    key = (fingerprint, tuple(shape), step)
+
+    with _grid_cache_lock:
+        if key in _grid_cache:
+            _grid_cache.move_to_end(key)
+            return _grid_cache[key]
+
+    x = _grid_nodes(shape[1], step)
+    y = _grid_nodes(shape[0], step)
+    grid = None
+    if directory is not None:
+        file_name = _grid_file_name(directory, fingerprint, shape, step)
+        if os.path.exists(file_name):
+            grid = load_coordinate_grid(file_name)
+            # A grid saved for another WCS or mesh is rebuilt (and replaced)
+            if (grid.fingerprint != fingerprint or not np.array_equal(grid.x, x)
+                    or not np.array_equal(grid.y, y)):
+                grid = None
+
+    if grid is None:
+        grid = build_coordinate_grid(get_wcs(fits_header), shape, step, fingerprint)
+        if directory is not None:
+            save_coordinate_grid(grid, directory)
+
+    with _grid_cache_lock:
+        grid = _grid_cache.setdefault(key, grid)
+        _grid_cache.move_to_end(key)
+        while len(_grid_cache) > GRID_CACHE_SIZE:
+            _grid_cache.popitem(last=False)
+
+    return grid
+
+
 def _tests():
     """ Unit tests for coordinates.py To run the test, execute:
 
@@ -155,11 +626,15 @@ def _tests():
     or CTRL+click on the file, and choose Run "Doctests in coordinates".
     """
     import doctest
+    from astropy.io import fits
+    from astropy.io.fits.header import Header
 
-    # Add the FITS file path to the global variables in order to
-    # be shared by all tests
+    # Add the FITS file path (and the astropy names used in the examples)
+    # to the global variables in order to be shared by all tests
     global_args = globals()
     global_args["fits_path"] = "../../../data/fits/common.fits"
+    global_args["fits"] = fits
+    global_args["Header"] = Header
 
     doctest.testmod(globs=global_args)
 
@@ -4,17 +4,31 @@
 import sys
 sys.path.append('../../skeletons')
 
+import math
+import os
+import re
+import threading
 import time
-import urllib.request
-from urllib.error import URLError, HTTPError
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
 from npac.coordinates import RaDec
 
-from typing import Tuple
+from typing import List, Tuple
 
 RequestCounter = 0
 
+# SIMBAD server (name[:port]).
+SIMBAD_HOST = 'simbad.u-strasbg.fr'
+
+# Maximum number of objects returned by SIMBAD for one query (set limit).
+SIMBAD_LIMIT = 100
+
+# Maximum number of cone searches sent in one script (the script is in the URL).
+SIMBAD_BATCH = 20
+
+# Text written by echodata before the results of the cone searches of a script.
+CONE_MARKER = 'npac-cone-{}'
+
 
 def format_char_for_simbad(text: str, char: str) -> str:
     """ Swap a character in a text with its Unicode code point (hexadecimal).
@@ -57,38 +71,33 @@ def format_char_for_simbad(text: str, char: str) -> str:
     return text
 
 
-def make_req(radec: RaDec, radius: float) -> str:
-    """ Build a request to the Simbad server according to a RA/Dec position
-    and an acceptance radius.
+def make_script(cones: List[Tuple[RaDec, float]], markers: bool=False) -> str:
+    """ Build a SIMBAD script with one cone search (query coo) per cone.
 
     Parameters
     ----------
-    radec : Instance of RaDec
-        Instance of RaDec. RA/Dec values are floats (degrees).
-    radius : float
-        Floating value of the acceptance radius (degrees)
+    cones : list of (RaDec, float)
+        RA/Dec position (degrees) and acceptance radius (degrees) of each cone.
+    markers : bool
+        If True, each query is preceded by an `echodata` line writing
+        CONE_MARKER in the data section, so the response can be split by cone.
 
     Returns
     ----------
-    request : str
-        String describing the request to Simbad.
+    script : str
+        Script, one command per line.
 
     Examples
     ----------
-    >>> radec = RaDec(1.0, 1.0)
-    >>> request = make_req(radec, 0.001)
-
-    Check we are querying the correct website
-    >>> assert("http://simbad.u-strasbg.fr" in request)
-
-    çheck that the radius value has been correctly understood, including the
-    transformation of characters (see `format_char_for_simbad()`).
-    >>> assert("radius%3D0.001" in request)
+    >>> script = make_script([(RaDec(1.0, 2.0), 0.1), (RaDec(3.0, -4.0), 0.2)], markers=True)
+    >>> for line in script.split('\\n')[2:]:
+    ...     print(line)
+    echodata npac-cone-0
+    query coo 1.0 2.0 radius=0.1d frame=FK5 epoch=J2000 equinox=2000
+    echodata npac-cone-1
+    query coo 3.0 -4.0 radius=0.2d frame=FK5 epoch=J2000 equinox=2000
+    <BLANKLINE>
     """
-    host_simbad = 'simbad.u-strasbg.fr'
-
-    # WGET with the "request" string built as below :
-
     script = ''
     # output format (for what comes from SIMBAD)
     script += 'format object f1 "'
@@ -103,30 +112,32 @@ def make_req(radec: RaDec, radius: float) -> str:
     script += '\t%DIST'
     script += '"\n'
 
-    script += 'query coo '
+    # limit return size (of the queries which follow)
+    script += 'set limit {}'.format(SIMBAD_LIMIT)
+    script += '\n'
 
-    # append "a_ra" (decimal degree)
-    script += '{}'.format(radec.ra)
-    script += ' '
+    for index, (radec, radius) in enumerate(cones):
+        if markers:
+            script += 'echodata ' + CONE_MARKER.format(index) + '\n'
 
-    # append "a_dec" (decimal degree)
-    script += '{}'.format(radec.dec)
-    script += ' radius='
+        # "a_ra" and "a_dec" (decimal degree), "a_radius" (decimal degree)
+        script += 'query coo {} {} radius={}d'.format(radec.ra, radec.dec, radius)
 
-    # append "a_radius" (decimal degree)
-    script += '{}'.format(radius)
+        # fk5
+        script += ' frame=FK5 epoch=J2000 equinox=2000'
+        script += '\n'
 
-    # d,m,s
-    script += 'd'
+    return script
 
-    # fk5
-    script += ' frame=FK5 epoch=J2000 equinox=2000'
-    script += '\n'
 
-    # limit return size
-    script += 'set limit 100 '
-    script += '\n'
+def script_req(script: str, host: str=SIMBAD_HOST) -> str:
+    """ Build the request sending a SIMBAD script (see `make_script`) to host.
 
+    Examples
+    ----------
+    >>> print(script_req('query id m1\\n', 'localhost:8080'))
+    http://localhost:8080/simbad/sim-script?script=query%20id%20m1%0D%0A&
+    """
     # "special characters" converted to "%02X" format :
     script = format_char_for_simbad(script, '%')
     script = format_char_for_simbad(script, '+')
@@ -139,12 +150,45 @@ def make_req(radec: RaDec, radius: float) -> str:
     script = script.replace('\n', '%0D%0A')
     script = format_char_for_simbad(script, '\t')
 
-    request = 'http://' + host_simbad + '/simbad/sim-script?'
+    request = 'http://' + host + '/simbad/sim-script?'
     request += 'script=' + script + '&'
 
     return request
 
 
+def make_req(radec: RaDec, radius: float, host: str=SIMBAD_HOST) -> str:
+    """ Build a request to the Simbad server according to a RA/Dec position
+    and an acceptance radius.
+
+    Parameters
+    ----------
+    radec : Instance of RaDec
+        Instance of RaDec. RA/Dec values are floats (degrees).
+    radius : float
+        Floating value of the acceptance radius (degrees)
+    host : str
+        SIMBAD server (name[:port])
+
+    Returns
+    ----------
+    request : str
+        String describing the request to Simbad.
+
+    Examples
+    ----------
+    >>> radec = RaDec(1.0, 1.0)
+    >>> request = make_req(radec, 0.001)
+
+    Check we are querying the correct website
+    >>> assert("http://simbad.u-strasbg.fr" in request)
+
+    çheck that the radius value has been correctly understood, including the
+    transformation of characters (see `format_char_for_simbad()`).
+    >>> assert("radius%3D0.001" in request)
+    """
+    return script_req(make_script([(radec, radius)]), host)
+
+
 def wget(req: str) -> str:
     """ Query Simbad with a request `req`.
 
@@ -177,6 +221,10 @@ def wget(req: str) -> str:
     >>> assert("simbatch done" in out)
     """
 
+    # urllib.request is slow to import, only the queries need it
+    import urllib.request
+    from urllib.error import URLError, HTTPError
+
     global RequestCounter
 
     retry = 0
@@ -214,19 +262,338 @@ def wget(req: str) -> str:
         raise
 
 
-def get_celestial_objects(radec: RaDec, radius: float=0.2) -> Tuple[OrderedDict, list, str]:
+# ======
+# Persistent cache of the SIMBAD cone searches
+# * SQLite file, one row per cone (rounded ra, dec, radius) with the response text
+# * entries older than ttl seconds are ignored, then purged
+# * the least recently used entries are evicted above max_bytes of responses
+# * a cone inside a cached complete cone is answered from the cached objects
+# =====
+
+# Line which starts the data section of a SIMBAD response.
+DATA_MARKER = '::data::' + '::' * 36
+
+# Decimals of the cache keys (degrees): 1e-6 degree is 3.6 milliarcsec.
+CACHE_DIGITS = 6
+
+# Default lifetime of a cached response (seconds): 30 days.
+CACHE_TTL = 30 * 24 * 3600.0
+
+# Default maximum size of the cached responses (bytes).
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Layout of the cache table, files with another layout are emptied.
+CACHE_VERSION = 2
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'contained', 'misses', 'entries', 'size'])
+
+
+def parse_hours(text: str) -> float:
+    """ Convert a sexagesimal right ascension (hours minutes seconds,
+    as written by SIMBAD %COO(A)) into degrees.
+
+    Examples
+    ----------
+    >>> print(round(parse_hours('00 03 55.585'), 6))
+    0.981604
+    >>> print(parse_hours('12 00'))
+    180.0
+    """
+    hours = 0.0
+    for rank, field in enumerate(text.split()):
+        hours += float(field) / 60.0 ** rank
+    return hours * 15.0
+
+
+def parse_degrees(text: str) -> float:
+    """ Convert a sexagesimal declination (degrees arcmin arcsec,
+    as written by SIMBAD %COO(D)) into degrees.
+
+    Examples
+    ----------
+    >>> print(round(parse_degrees('+00 58 11.72'), 6))
+    0.969922
+    >>> print(parse_degrees('-75 30'))
+    -75.5
+    >>> print(parse_degrees('-00 30'))
+    -0.5
+    """
+    text = text.strip()
+    sign = -1.0 if text.startswith('-') else 1.0
+    degrees = 0.0
+    for rank, field in enumerate(text.lstrip('+-').split()):
+        degrees += float(field) / 60.0 ** rank
+    return sign * degrees
+
+
+def separation(ra1: float, dec1: float, ra2: float, dec2: float) -> float:
+    """ Angular distance (degrees) between two ra/dec positions (degrees),
+    haversine formula.
+
+    Examples
+    ----------
+    >>> print(round(separation(10.0, 0.0, 10.0, 1.0), 9))
+    1.0
+    >>> print(round(separation(359.5, 0.0, 0.5, 0.0), 9))
+    1.0
+    """
+    ra1, dec1, ra2, dec2 = (math.radians(a) for a in (ra1, dec1, ra2, dec2))
+    h = (math.sin((dec2 - dec1) / 2.0) ** 2
+         + math.cos(dec1) * math.cos(dec2) * math.sin((ra2 - ra1) / 2.0) ** 2)
+    return math.degrees(2.0 * math.asin(min(1.0, math.sqrt(h))))
+
+
+def split_response(text: str) -> Tuple[str, List[str]]:
+    """ Split a SIMBAD response into its header (up to the data marker line
+    included) and its data lines.
+
+    Examples
+    ----------
+    >>> text = 'C.D.S.\\n' + DATA_MARKER + '\\n\\na\\tb\\n\\nc\\td\\n'
+    >>> head, rows = split_response(text)
+    >>> print(head.endswith(DATA_MARKER), rows)
+    True ['a\\tb', 'c\\td']
+    """
+    lines = text.split('\n')
+    for index, line in enumerate(lines):
+        if line.strip() == DATA_MARKER:
+            rows = [row for row in lines[index + 1:] if row.strip() != '']
+            return '\n'.join(lines[:index + 1]), rows
+    return text, []
+
+
+class SimbadCache(object):
+    """ Persistent cache of SIMBAD cone search responses (SQLite file).
+
+    Cones are keyed by the SIMBAD host and by ra, dec and radius rounded to
+    CACHE_DIGITS decimals: the responses of a mirror or a stand-in server are
+    never returned for another server.
+    A cone which is not cached is answered from a cached cone containing it,
+    as long as that cone is complete (less than SIMBAD_LIMIT objects):
+    its objects are filtered, and their distances recomputed, from their
+    %COO(A) / %COO(D) coordinates.
+
+    Examples
+    ----------
+    >>> cache = SimbadCache(':memory:')
+    >>> head = 'C.D.S.\\n' + DATA_MARKER
+    >>> rows = ['00 04 00.000\\t+01 00 00.00\\tStar\\tnear\\t  36.00',
+    ...         '00 04 00.000\\t+01 06 00.00\\tStar\\tfar\\t 360.00']
+    >>> cache.put(RaDec(1.0, 1.0), 0.2, '\\n'.join([head] + rows))
+
+    Same cone: cached response
+    >>> print(cache.get(RaDec(1.0, 1.0), 0.2) == '\\n'.join([head] + rows))
+    True
+
+    Smaller cone inside: only the objects inside, distances from the new centre
+    >>> _, inside = split_response(cache.get(RaDec(1.0, 1.0), 0.05))
+    >>> print(inside)
+    ['00 04 00.000\\t+01 00 00.00\\tStar\\tnear\\t0.000']
+
+    Cone not contained in the cached one, or asked to another server
+    >>> print(cache.get(RaDec(1.0, 1.1), 0.2))
+    None
+    >>> print(cache.get(RaDec(1.0, 1.0), 0.2, 'localhost:8080'))
+    None
+
+    Data lines which are not objects are skipped
+    >>> cache.put(RaDec(2.0, 2.0), 0.2, '\\n'.join([head, 'npac-cone-0'] + rows))
+    >>> print(len(split_response(cache.get(RaDec(2.0, 2.0), 0.1))[1]))
+    0
+    >>> print(cache.info())
+    CacheInfo(hits=1, contained=2, misses=2, entries=2, size=360)
+    """
+
+    def __init__(self, path: str, ttl: float = CACHE_TTL, max_bytes: int = CACHE_MAX_BYTES):
+        """ Open (or create) the cache file, path ':memory:' for a cache in memory """
+        # sqlite3 is only needed once a cache is used
+        import sqlite3
+
+        if path != ':memory:':
+            directory = os.path.dirname(path)
+            if directory != '':
+                os.makedirs(directory, exist_ok=True)
+
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.contained = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        with self.db:
+            # Files written with another layout of the table are emptied
+            if self.db.execute('PRAGMA user_version').fetchone()[0] != CACHE_VERSION:
+                self.db.execute('DROP TABLE IF EXISTS cones')
+                self.db.execute('PRAGMA user_version = {:d}'.format(CACHE_VERSION))
+            self.db.execute('CREATE TABLE IF NOT EXISTS cones ('
+                            'host TEXT, ra REAL, dec REAL, radius REAL, created REAL, used REAL, '
+                            'count INTEGER, size INTEGER, response TEXT, '
+                            'PRIMARY KEY (host, ra, dec, radius))')
+            self.db.execute('CREATE INDEX IF NOT EXISTS cones_dec ON cones (dec)')
+
+    def key(self, radec: RaDec, radius: float, host: str) -> Tuple[str, float, float, float]:
+        """ Host, rounded ra (in [0, 360)), dec and radius of a cone """
+        return (host, round(float(radec.ra) % 360.0, CACHE_DIGITS), round(float(radec.dec), CACHE_DIGITS),
+                round(float(radius), CACHE_DIGITS))
+
+    def get(self, radec: RaDec, radius: float, host: str=SIMBAD_HOST) -> str:
+        """ Cached response of the cone (queried to host), or None """
+        host, ra, dec, radius = self.key(radec, radius, host)
+        now = time.time()
+        oldest = now - self.ttl
+
+        with self.lock, self.db:
+            found = self.db.execute('SELECT response FROM cones WHERE host = ? AND ra = ? AND dec = ? '
+                                    'AND radius = ? AND created >= ?',
+                                    (host, ra, dec, radius, oldest)).fetchone()
+            if found is not None:
+                self.db.execute('UPDATE cones SET used = ? WHERE host = ? AND ra = ? AND dec = ? AND radius = ?',
+                                (now, host, ra, dec, radius))
+                self.hits += 1
+                return found[0]
+
+            # The distance between the centres is at least their dec difference
+            candidates = self.db.execute('SELECT ra, dec, radius, response FROM cones '
+                                         'WHERE host = ? AND radius >= ? AND count < ? AND created >= ? '
+                                         'AND dec BETWEEN ? - radius AND ? + radius ORDER BY radius',
+                                         (host, radius, SIMBAD_LIMIT, oldest, dec, dec)).fetchall()
+            for cone_ra, cone_dec, cone_radius, response in candidates:
+                if separation(ra, dec, cone_ra, cone_dec) + radius <= cone_radius:
+                    self.db.execute('UPDATE cones SET used = ? '
+                                    'WHERE host = ? AND ra = ? AND dec = ? AND radius = ?',
+                                    (now, host, cone_ra, cone_dec, cone_radius))
+                    self.contained += 1
+                    return self.restrict(response, ra, dec, radius)
+
+            self.misses += 1
+            return None
+
+    def restrict(self, response: str, ra: float, dec: float, radius: float) -> str:
+        """ Keep the objects of a cached response which are inside the cone,
+        with their distance (arcsec) to its centre (other data lines are dropped) """
+        head, rows = split_response(response)
+        kept = []
+        for row in rows:
+            data = row.split('\t')
+            if len(data) < 5:
+                continue
+            dist = separation(ra, dec, parse_hours(data[0]), parse_degrees(data[1]))
+            if dist <= radius:
+                data[4] = '{:.3f}'.format(dist * 3600.0)
+                kept.append('\t'.join(data))
+        return '\n'.join([head] + kept)
+
+    def put(self, radec: RaDec, radius: float, response: str, host: str=SIMBAD_HOST) -> None:
+        """ Store the response of a cone (queried to host), then evict the least
+        recently used responses above max_bytes and those older than ttl """
+        host, ra, dec, radius = self.key(radec, radius, host)
+        now = time.time()
+        count = len(split_response(response)[1])
+        size = len(response.encode('utf-8'))
+
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO cones VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            (host, ra, dec, radius, now, now, count, size, response))
+            self.db.execute('DELETE FROM cones WHERE created < ?', (now - self.ttl,))
+
+            total = 0
+            evicted = []
+            for key_host, key_ra, key_dec, key_radius, key_size in self.db.execute(
+                    'SELECT host, ra, dec, radius, size FROM cones ORDER BY used DESC'):
+                total += key_size
+                if total > self.max_bytes:
+                    evicted.append((key_host, key_ra, key_dec, key_radius))
+            self.db.executemany('DELETE FROM cones WHERE host = ? AND ra = ? AND dec = ? AND radius = ?',
+                                evicted)
+
+    def info(self) -> 'CacheInfo':
+        """ Hits (same cone), contained (answered from a larger cone), misses,
+        number of entries and total size of the responses """
+        with self.lock:
+            entries, size = self.db.execute('SELECT COUNT(*), TOTAL(size) FROM cones').fetchone()
+            return CacheInfo(self.hits, self.contained, self.misses, entries, int(size))
+
+    def close(self) -> None:
+        """ Close the cache file """
+        self.db.close()
+
+
+_default_cache = None
+
+
+def get_default_cache() -> SimbadCache:
+    """ Cache used by get_celestial_objects, in the file given by the
+    SIMBAD_CACHE environment variable (default ~/.cache/npac/simbad.sqlite).
+    An empty SIMBAD_CACHE disables the cache (returns None).
+    """
+    global _default_cache
+
+    path = os.environ.get('SIMBAD_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'npac', 'simbad.sqlite'))
+    if path == '':
+        return None
+    if _default_cache is None:
+        _default_cache = SimbadCache(path)
+    return _default_cache
+
+
+def parse_objects(rows: List[str]) -> OrderedDict:
+    """ Stars of the data lines of a SIMBAD response, sorted by distance.
+
+    Examples
+    ----------
+    >>> rows = ['00 04 00.0\\t+01 00 00\\tStar\\tfar\\t 360.00',
+    ...         '00 04 00.0\\t+01 00 00\\tGalaxy\\tgal\\t 60.00',
+    ...         '00 04 00.0\\t+01 00 00\\tStar\\tnear\\t  36.00']
+    >>> print(list(parse_objects(rows).items()))
+    [('near', 36.0), ('far', 360.0)]
+    """
+    raw_objects = dict()
+
+    for line in rows:
+        line = line.strip()
+        if line == '':
+            continue
+
+        data = line.split('\t')
+        if len(data) < 5:
+            continue
+        obj_type = data[2].strip()
+        obj_name = data[3].strip()
+        obj_dist = data[4].strip()
+        if obj_type == 'Star':
+            raw_objects[obj_name] = float(obj_dist)
+
+    # here we sort the dictionary keys (name of the star)
+    # depending on the dictionary values (distance of the star to the centre of the cone)
+    objects = OrderedDict()
+    for k in sorted(raw_objects, key=raw_objects.__getitem__):
+        objects[k] = raw_objects[k]
+
+    return objects
+
+
+def get_celestial_objects(radec: RaDec, radius: float=0.2, cache: SimbadCache=None,
+                          host: str=SIMBAD_HOST) -> Tuple[OrderedDict, list, str]:
     """ Retrieve only celestial objects from Simbad contained in the circle
     defined by radec and radius.
 
     Note that it also returns the full results returned by Simbad (not only
     celestial objects), and the initial request for further inspection.
 
+    The responses are kept in a SimbadCache: a cone already queried,
+    or inside a complete cone already queried, is answered without network.
+
     Parameters
     ----------
     radec : Instance of RaDec
         Instance of RaDec. RA/Dec values are floats (degrees).
     radius : float
         Floating value of the acceptance radius (degrees)
+    cache : Instance of SimbadCache
+        Cache of the responses, by default get_default_cache()
+    host : str
+        SIMBAD server (name[:port])
 
     Returns
     ----------
@@ -251,37 +618,155 @@ def get_celestial_objects(radec: RaDec, radius: float=0.2) -> Tuple[OrderedDict,
     >>> len(vals)
     2
     """
-    req = make_req(radec, radius)
-    out = wget(req)
-    objects = OrderedDict()
-
+    if cache is None:
+        cache = get_default_cache()
+
+    req = make_req(radec, radius, host)
+    out = None
+    if cache is not None:
+        out = cache.get(radec, radius, host)
+    if out is None:
+        out = wget(req)
+        # Only complete responses (with a data section) are cached
+        if cache is not None and out is not None and DATA_MARKER in out:
+            cache.put(radec, radius, out, host)
+
+    objects = parse_objects(split_response(out)[1])
     out = out.split('\n')
-    in_data = False
-    raw_objects = dict()
 
-    for line in out:
-        line = line.strip()
-        if line == '':
-            continue
-        if not in_data:
-            if line == '::data::' + '::' * 36:
-                in_data = True
-            continue
+    return objects, out, req
 
-        data = line.split('\t')
-        obj_type = data[2].strip()
-        obj_name = data[3].strip()
-        obj_dist = data[4].strip()
-        if obj_type == 'Star':
-            raw_objects[obj_name] = float(obj_dist)
 
-    # here we sort the dictionary keys (name of the star) 
-    # depending on the dictionary values (distance of the star... to what ?)
-    objects = OrderedDict()
-    for k in sorted(raw_objects, key=raw_objects.__getitem__):
-      objects[k] = raw_objects[k]
-    
-    return objects, out, req
+def split_batch_response(text: str, script: str) -> List[str]:
+    """ Split the response to a script of cone searches with markers
+    (see `make_script`) into one response per cone: the header of the
+    response followed by the data lines of the cone.
+
+    A cone gets None when its query is reported in the error section
+    (except for "No astronomical object found", which gives no data line)
+    or when its marker is missing from the data section.
+
+    Examples
+    ----------
+    >>> script = make_script([(RaDec(1.0, 2.0), 0.1), (RaDec(3.0, -4.0), 0.2),
+    ...                       (RaDec(5.0, 6.0), 0.1)], markers=True)
+    >>> text = '\\n'.join(['::error::', '[6] No astronomical object found : ',
+    ...                     '[8] Unknown frame', DATA_MARKER,
+    ...                     'npac-cone-0', 'a\\tb', 'c\\td', 'npac-cone-1', 'npac-cone-2'])
+    >>> for response in split_batch_response(text, script):
+    ...     print(None if response is None else response.split('\\n')[4:])
+    ['a\\tb', 'c\\td']
+    []
+    None
+    """
+    lines = script.split('\n')
+    query_lines = [number for number, line in enumerate(lines, 1) if line.startswith('query coo')]
+    markers = dict((CONE_MARKER.format(index), index) for index in range(len(query_lines)))
+
+    head, rows = split_response(text)
+
+    # Error section: "[line number] message"
+    errors = dict()
+    for line in head.split('\n'):
+        match = re.match(r'^\[(\d+)\]\s*(.*)$', line.strip())
+        if match is not None:
+            errors[int(match.group(1))] = match.group(2)
+
+    sections = dict()
+    current = None
+    for row in rows:
+        if row.strip() in markers:
+            current = markers[row.strip()]
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(row)
+
+    responses = []
+    for index, number in enumerate(query_lines):
+        failed = number in errors and 'No astronomical object found' not in errors[number]
+        if failed or index not in sections:
+            responses.append(None)
+        else:
+            responses.append('\n'.join([head] + sections[index]))
+    return responses
+
+
+def query_batch(cones: List[Tuple[RaDec, float]], host: str=SIMBAD_HOST) -> List[str]:
+    """ Send all the cone searches in a single script, returns one response
+    per cone (see `split_batch_response`), None for the cones which failed.
+
+    Raises
+    ----------
+    IOError
+        If the response has no data section (the request itself failed).
+        The errors of `wget` (server unreachable...) are not caught.
+    """
+    script = make_script(cones, markers=True)
+    out = wget(script_req(script, host))
+
+    if out is None or DATA_MARKER not in out:
+        raise IOError('no data in the SIMBAD response to a batch of {} cones'.format(len(cones)))
+    return split_batch_response(out, script)
+
+
+def get_celestial_objects_many(positions: List[RaDec], radius: float=0.2,
+                               max_per_request: int=SIMBAD_BATCH, cache: SimbadCache=None,
+                               host: str=SIMBAD_HOST) -> List[OrderedDict]:
+    """ Retrieve the celestial objects around many positions, with
+    max_per_request cone searches per SIMBAD request instead of one.
+
+    Cached cones are answered without network (see `SimbadCache`).
+    A cone reported as failed in the response to its batch is queried alone
+    (`get_celestial_objects`). A request which fails as a whole raises
+    (see `query_batch`): the cones are not queried again one by one.
+
+    Parameters
+    ----------
+    positions : list of RaDec
+        RA/Dec positions (degrees)
+    radius : float
+        Floating value of the acceptance radius (degrees)
+    max_per_request : int
+        Maximum number of cone searches in one request
+    cache : Instance of SimbadCache
+        Cache of the responses, by default get_default_cache()
+    host : str
+        SIMBAD server (name[:port])
+
+    Returns
+    ----------
+    objects : list of OrderedDict
+        Celestial objects of each position, as `get_celestial_objects`.
+    """
+    if cache is None:
+        cache = get_default_cache()
+
+    results = [None] * len(positions)
+    pending = []
+    for index, radec in enumerate(positions):
+        out = None
+        if cache is not None:
+            out = cache.get(radec, radius, host)
+        if out is not None:
+            results[index] = parse_objects(split_response(out)[1])
+        else:
+            pending.append(index)
+
+    for start in range(0, len(pending), max(1, max_per_request)):
+        chunk = pending[start:start + max(1, max_per_request)]
+        responses = query_batch([(positions[index], radius) for index in chunk], host)
+
+        for index, out in zip(chunk, responses):
+            if out is not None:
+                if cache is not None:
+                    cache.put(positions[index], radius, out, host)
+                results[index] = parse_objects(split_response(out)[1])
+                continue
+
+            # Fall back to a query of this position alone
+            results[index] = get_celestial_objects(positions[index], radius, cache, host)[0]
+
+    return results
 
 
 def _tests():
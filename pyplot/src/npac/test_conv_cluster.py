@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import contextlib
+import io
+import os
+import numpy as np
+import lib_fits
+import lib_frame
+import lib_conv
+import lib_cluster
+
+
+def reference_scan(pixels, margin, pattern):
+    """Per-pixel loop which scan replaces"""
+    height, width = np.shape(pixels)
+    output = np.zeros((height - 2*margin, width - 2*margin), np.float64)
+    for i in range(margin, height - margin):
+        for j in range(margin, width - margin):
+            image = pixels[i-margin:i+margin+1, j-margin:j+margin+1]
+            output[i-margin, j-margin] = np.sum(image * pattern)
+    return output
+
+
+def reference_peaks(pixels, margin, threshold):
+    """Per-pixel loop of is_peak which peaks replaces"""
+    height, width = np.shape(pixels)
+    return [[i-margin, j-margin]
+            for i in range(margin, height - margin)
+            for j in range(margin, width - margin)
+            if lib_conv.is_peak(pixels, i, j, threshold)]
+
+
+rng = np.random.RandomState(0)
+
+# scan : every backend against the loop, for a separable pattern (Gaussian)
+# and a non separable one, on an image larger than the overlap-add block
+for pixels in (rng.uniform(0.0, 100.0, (60, 45)), rng.uniform(0.0, 100.0, (40, lib_conv.FFT_BLOCK + 30))):
+    for pattern in (lib_conv.gaussian(9) / np.sum(lib_conv.gaussian(9)), rng.uniform(-1.0, 1.0, (5, 5))):
+        margin = len(pattern) // 2
+        expected = reference_scan(pixels, margin, pattern)
+        methods = ['auto', 'direct', 'fft', 'overlap-add']
+        if lib_conv.separate(pattern) is not None:
+            methods.append('separable')
+        print(all(np.allclose(lib_conv.scan(pixels, margin, pattern, method), expected)
+                  for method in methods))
+
+# peaks against is_peak, with a scalar threshold, on floats and on integers
+# whose equal neighbours are not peaks
+for pixels in (rng.uniform(0.0, 100.0, (50, 70)), rng.randint(0, 6, (50, 70))):
+    peaks = lib_conv.peaks(pixels, 1, 50.0 if pixels.dtype.kind == 'f' else 3)
+    expected = reference_peaks(pixels, 1, 50.0 if pixels.dtype.kind == 'f' else 3)
+    print(np.array_equal(peaks, np.reshape(expected, (-1, 2))))
+
+# build_clusters against build_cluster, on the peaks of common.fits
+header, pixels = lib_fits.read_first_image(os.path.join(os.environ.get('DATAPATH', '../data'), 'common.fits'))
+frame = lib_frame.analysis(pixels)
+threshold = frame.threshold()
+peaks = np.reshape(frame.peaks(), (-1, 2))
+
+ext, lums, lumpeak = lib_cluster.build_clusters(pixels, peaks, threshold, frame.integral())
+with contextlib.redirect_stdout(io.StringIO()):
+    clusters = [lib_cluster.build_cluster(pixels, peak, threshold, frame.integral()) for peak in peaks]
+
+print(all((cluster is None) == (e < 1) for cluster, e in zip(clusters, ext)))
+print(all(cluster.ext == e and cluster.lum == l and cluster.lumpeak == p
+          for cluster, e, l, p in zip(clusters, ext, lums, lumpeak) if cluster is not None))
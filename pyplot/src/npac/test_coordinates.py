@@ -30,5 +30,29 @@ radec = RaDec(2, 1)
 print(xy_to_radec(wcs, pxy) == radec)
 print(radec_to_xy(wcs, radec) == pxy)
 
+class FakeWcsMany():
+    """Fake WCS for arrays of coordinates.
+
+    Swaps the two columns of an (N, 2) array, as FakeWcs does for one pixel.
+    """
+    def wcs_pix2world(self, x_y, fake):
+        """Fake pixel coordinates to world coordinates transformation"""
+        return x_y[:, ::-1]
+
+    def wcs_world2pix(self, radec, fake):
+        """Fake world coordinates to pixel coordinates transformation"""
+        return radec[:, ::-1]
+
+wcs_many = FakeWcsMany()
+xy = np.array([[1, 2], [3, 4], [5, 6]])
+print((xy_to_radec_many(wcs_many, xy) == xy[:, ::-1]).all())
+print((radec_to_xy_many(wcs_many, xy[:, ::-1]) == xy).all())
+print(xy_to_radec_many(wcs_many, np.empty((0, 2))).shape == (0, 2))
+
+# The WCS fingerprint ignores the keywords which are not part of the WCS
+header = {'CTYPE1': 'RA---TAN', 'CRVAL1': 10.0, 'CRPIX1': 5.0, 'EXPTIME': 30.0}
+print(wcs_fingerprint(header) == wcs_fingerprint(dict(header, EXPTIME=60.0)))
+print(wcs_fingerprint(header) != wcs_fingerprint(dict(header, CRPIX1=6.0)))
+
 sys.exit(0)
 
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import subprocess
+import sys
+
+# The batch driver is run from the source directory, on the bundled frames
+# (global.fits is not a valid FITS file and gives an error record)
+os.environ.setdefault('DATAPATH', '../data')
+names = ['common', 'specific', 'global']
+
+# Several worker processes, records on the standard output
+batch = subprocess.run([sys.executable, 'batch.py', '-j', '2'] + names,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+print(batch.returncode == 2)
+
+# Every line of the standard output is a JSON record (nothing else is printed)
+lines = batch.stdout.splitlines()
+try:
+    records = [json.loads(line) for line in lines]
+    print(True)
+except ValueError:
+    records = []
+    print(False)
+print(len(records) == len(names))
+print(['error' in record for record in records] == [False, False, True])
+print([os.path.basename(record['file']) for record in records] == [name + '.fits' for name in names])
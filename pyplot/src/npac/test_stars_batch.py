@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from npac.stars import *
+import http.server
+import os
+import sys
+import threading
+import urllib.parse
+
+# The queries of this test must not use (or fill) the default cache
+os.environ['SIMBAD_CACHE'] = ''
+
+# Fake sky: name, type, ra, dec (degrees)
+SKY = [('star A', 'Star', 10.00, 20.00),
+       ('star B', 'Star', 10.05, 20.02),
+       ('galaxy C', 'Galaxy', 10.01, 19.99),
+       ('star D', 'Star', 200.00, -45.00),
+       ('star E', 'Star', 200.10, -45.10),
+       ('star F', 'Star', 300.00, -89.00)]
+
+
+def sexagesimal(value, hours):
+    """Format degrees as SIMBAD %COO(A) (hours) or %COO(D) (degrees)"""
+    sign = '-' if value < 0 else '+'
+    value = abs(value) / 15.0 if hours else abs(value)
+    units = int(value)
+    minutes = int((value - units) * 60.0)
+    seconds = ((value - units) * 60.0 - minutes) * 60.0
+    if hours:
+        return '{:02d} {:02d} {:06.3f}'.format(units, minutes, seconds)
+    return '{}{:02d} {:02d} {:05.2f}'.format(sign, units, minutes, seconds)
+
+
+class FakeSimbad(http.server.BaseHTTPRequestHandler):
+    """Stand-in for the sim-script service of SIMBAD.
+
+    Answers the echodata and query coo commands from the fake sky.
+    In a script of several queries, a cone centred at dec = -89 fails.
+    """
+    requests = 0
+    broken = False
+
+    def do_GET(self):
+        """Run the script of the request (or fail as a whole if broken)"""
+        FakeSimbad.requests += 1
+        if FakeSimbad.broken:
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b'C.D.S.  -  SIMBAD4\n\nservice unavailable\n')
+            return
+        query = urllib.parse.urlparse(self.path).query
+        script = urllib.parse.parse_qs(query)['script'][0].split('\r\n')
+        several = len([line for line in script if line.startswith('query coo')]) > 1
+
+        errors = []
+        data = []
+        for number, line in enumerate(script, 1):
+            words = line.split()
+            if line.startswith('echodata '):
+                data.append(line[len('echodata '):])
+            elif line.startswith('query coo '):
+                ra, dec = float(words[2]), float(words[3])
+                radius = float(words[4][len('radius='):-1])
+                if several and dec == -89.0:
+                    errors.append('[{}] Internal error'.format(number))
+                    continue
+                found = []
+                for name, otype, star_ra, star_dec in SKY:
+                    dist = separation(ra, dec, star_ra, star_dec)
+                    if dist <= radius:
+                        found.append('{}\t{}\t{}\t{}\t{:.2f}'.format(sexagesimal(star_ra, True),
+                                                                     sexagesimal(star_dec, False),
+                                                                     otype, name, dist * 3600.0))
+                if len(found) == 0:
+                    errors.append('[{}] No astronomical object found : '.format(number))
+                data.extend(found)
+
+        text = 'C.D.S.  -  SIMBAD4\n\n'
+        if len(errors) > 0:
+            text += '::error' + '::' * 36 + '\n\n' + '\n'.join(errors) + '\n\n'
+        text += DATA_MARKER + '\n\n' + '\n'.join(data) + '\n'
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.end_headers()
+        self.wfile.write(text.encode('utf-8'))
+
+    def log_message(self, *args):
+        """Silent server"""
+        pass
+
+
+server = http.server.HTTPServer(('localhost', 0), FakeSimbad)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+host = 'localhost:{}'.format(server.server_address[1])
+
+positions = [RaDec(10.0, 20.0), RaDec(200.0, -45.0), RaDec(50.0, 50.0),
+             RaDec(300.0, -89.0), RaDec(10.02, 20.0)]
+
+# One query per position
+single = [get_celestial_objects(radec, 0.2, host=host)[0] for radec in positions]
+print(FakeSimbad.requests == 5)
+print(list(single[0].keys()) == ['star A', 'star B'])
+
+# Two positions per request (3 requests), the position at dec = -89 fails
+# in its batch and is queried alone (1 request)
+FakeSimbad.requests = 0
+many = get_celestial_objects_many(positions, 0.2, max_per_request=2, host=host)
+print(FakeSimbad.requests == 4)
+print(many == single)
+print(len(many[2]) == 0)
+
+# Cached cones are not queried again
+FakeSimbad.requests = 0
+cache = SimbadCache(':memory:')
+get_celestial_objects_many(positions, 0.2, cache=cache, host=host)
+print(get_celestial_objects_many(positions, 0.2, cache=cache, host=host) == single)
+print(FakeSimbad.requests == 2)
+
+# A request which fails as a whole raises, without querying each cone alone
+FakeSimbad.requests = 0
+FakeSimbad.broken = True
+try:
+    get_celestial_objects_many(positions, 0.2, host=host)
+    print(False)
+except IOError:
+    print(FakeSimbad.requests == 1)
+FakeSimbad.broken = False
+
+# ex5 path: RA/Dec of the brightest cluster of common.fits, then its stars
+import contextlib
+import io
+import npac.stars
+import lib_fits
+import lib_cluster
+import lib_stars
+import ex5_stars
+
+os.environ.setdefault('DATAPATH', '../data')
+header, pixels = lib_fits.read_first_image(os.path.join(os.environ['DATAPATH'], 'common.fits'))
+clusters = lib_stars.fill_radec(lib_cluster.find_clusters(pixels, 1), header)
+SKY[:] = [('star G', 'Star', clusters[0].ra, clusters[0].dec + 0.01)]
+
+# ex5 queries the default host: send its requests to the stand-in server
+wget_simbad = npac.stars.wget
+npac.stars.wget = lambda req: wget_simbad(req.replace(SIMBAD_HOST, host))
+sys.argv = ['ex5_stars.py', '-b', 'common']
+output = io.StringIO()
+with contextlib.redirect_stdout(output):
+    ex5_stars.main()
+npac.stars.wget = wget_simbad
+print('RESULT: celestial_object_00 = star G' in output.getvalue())
+print('RESULT: dist_00 =  36.0' in output.getvalue())
+
+server.shutdown()
+sys.exit(0)